@@ -1,3 +1,5 @@
+from typing import Optional
+
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
 from app.conversation.dialogs.dialogs import buttons_callbacks, buttons_names, msg
@@ -42,6 +44,7 @@ class MenuButtons:
         kb.add(
             KeyboardButton(buttons_names.insert_expenses),
             KeyboardButton(buttons_names.get_expenses_info),
+            KeyboardButton(buttons_names.expenses_history),
         )
         return kb
 
@@ -50,3 +53,33 @@ class MenuButtons:
         kb = ReplyKeyboardMarkup(resize_keyboard=True, row_width=1, one_time_keyboard=True)
         kb.add(buttons_names.back_to_menu)
         return kb
+
+
+class StatisticsButtons:
+
+    @staticmethod
+    def charts_kb() -> InlineKeyboardMarkup:
+        kb = InlineKeyboardMarkup(row_width=1)
+        kb.add(
+            InlineKeyboardButton(msg.chart_categories_week, callback_data=buttons_callbacks.chart_categories_week),
+            InlineKeyboardButton(msg.chart_categories_month, callback_data=buttons_callbacks.chart_categories_month),
+            InlineKeyboardButton(msg.chart_days_month, callback_data=buttons_callbacks.chart_days_month),
+        )
+        return kb
+
+
+class HistoryButtons:
+
+    @staticmethod
+    def pages_kb(newer_data: Optional[str], older_data: Optional[str]) -> Optional[InlineKeyboardMarkup]:
+        """Back to newer expenses and forward to older ones. Callback data carries the page cursor"""
+        buttons = []
+        if newer_data:
+            buttons.append(InlineKeyboardButton(msg.btn_back, callback_data=newer_data))
+        if older_data:
+            buttons.append(InlineKeyboardButton(msg.btn_forward, callback_data=older_data))
+        if not buttons:
+            return None
+        kb = InlineKeyboardMarkup()
+        kb.row(*buttons)
+        return kb
@@ -28,6 +28,35 @@ class Messages:
     insert_expense: str = "Введите информацию о расходах в формате 'Сумма валюта категория'. Например, 100 рублей " \
                           "продукты "
     authorization_success: str = "Добро пожаловать!"
+    set_budget: str = "Введите лимит на месяц в формате '/budget Сумма категория'. Например, /budget 10000 продукты"
+    budget_saved: str = "Лимит на месяц для категории {category} установлен: {limit_sum}"
+    budget_warning: str = "Внимание! Расходы по категории {category} за месяц составили {total} " \
+                          "из лимита {limit_sum}"
+    budget_exceeded: str = "Лимит по категории {category} превышен: {total} из {limit_sum}"
+    amount_too_large: str = "Слишком большая сумма, максимум {max_amount}"
+    weekly_digest: str = "Ваши расходы за неделю {date_from} - {date_to}:"
+    monthly_digest: str = "Ваши расходы за месяц {date_from} - {date_to}:"
+    digest_total: str = "Итого: "
+    throttled: str = "Слишком много сообщений, подождите немного"
+    overloaded: str = "Сервис перегружен, попробуйте через минуту"
+    choose_chart: str = "Выберите график"
+    no_expenses_for_period: str = "За выбранный период расходов нет"
+    chart_categories_week: str = "Расходы по категориям за неделю"
+    chart_categories_month: str = "Расходы по категориям за месяц"
+    chart_days_month: str = "Расходы по дням за месяц"
+    analytics_title: str = "Самые большие расходы с начала месяца:"
+    analytics_category: str = "{label}: {month_to_date} ({month_change} к прошлому месяцу, {year_change} к прошлому " \
+                              "году), в среднем за день {avg_7} за 7 дней и {avg_30} за 30 дней"
+    analytics_anomaly: str = "Необычно большой расход {day}: {label} {amount}"
+    analytics_no_data: str = "нет данных"
+    job_preparing: str = "Готовим отчет, пришлем его сюда…"
+    job_already_preparing: str = "Этот отчет уже готовится, пришлем его сюда"
+    job_timeout: str = "Не удалось подготовить отчет вовремя, попробуйте позже"
+    job_failed: str = "Не удалось подготовить отчет"
+    year_report: str = "Расходы за {year} год:"
+    year_report_by_month: str = "По месяцам:"
+    expenses_history: str = "Ваши расходы:"
+    expenses_history_empty: str = "Расходов пока нет"
 
 
 @dataclass(frozen=True)
@@ -41,11 +70,16 @@ class ButtonNames:
     back_to_menu: str = "Вернуться в меню"
     insert_expenses: str = "Внести информацию о расходах"
     get_expenses_info: str = "Получить статистику по расходам"
+    expenses_history: str = "История расходов"
 
 
 @dataclass(frozen=True)
 class ButtonCallbacks:
-    pass
+    chart_categories_week: str = "chart_categories_week"
+    chart_categories_month: str = "chart_categories_month"
+    chart_days_month: str = "chart_days_month"
+    history_newer: str = "history_newer"
+    history_older: str = "history_older"
 
 
 msg = Messages()
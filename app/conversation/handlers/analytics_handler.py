@@ -0,0 +1,38 @@
+import logging
+import math
+
+from aiogram import types
+from aiogram.dispatcher import Dispatcher
+
+from app.conversation.dialogs.dialogs import msg
+from app.services.analytics import SpendingAnalytics
+from environment import Environment
+from middlewares.throttling import throttling_cost
+
+
+def _format_change(change: float) -> str:
+    return msg.analytics_no_data if math.isnan(change) else f"{change:+.0%}"
+
+
+def init_analytics_handler(dp: Dispatcher, _env: Environment, analytics: SpendingAnalytics):
+    logger = logging.getLogger(__name__)
+    logger.info("Start analytics handler")
+
+    @dp.message_handler(commands={"analytics"}, state="*")
+    @throttling_cost(3)
+    async def send_analytics(message: types.Message):
+        report = await analytics.get_report(message.from_user.id, top_n=_env.analytics_top_categories)
+        if not report.top and not report.anomalies:
+            await message.answer(msg.no_expenses_for_period)
+            return
+
+        lines = [msg.analytics_title]
+        for index in report.top:
+            lines.append(msg.analytics_category.format(
+                label=report.labels[index], month_to_date=f"{report.month_to_date[index]:.2f}",
+                month_change=_format_change(report.month_change[index]),
+                year_change=_format_change(report.year_change[index]),
+                avg_7=f"{report.avg_7[index]:.2f}", avg_30=f"{report.avg_30[index]:.2f}"))
+        for label, day, amount in report.anomalies:
+            lines.append(msg.analytics_anomaly.format(label=label, day=day.strftime("%d.%m"), amount=f"{amount:.2f}"))
+        await message.answer("\n".join(lines))
@@ -10,12 +10,12 @@ from app.conversation.custom_filters.user_status_filter import check_authorised,
 from app.conversation.dialogs.buttons import authorize, confirm_or_not_confirm_kb, MenuButtons
 from app.conversation.dialogs.dialogs import msg, confirmation_callbacks
 from app.conversation.states.authorization_states import AuthorizationState
-from db.db_functions import DbFunctions
+from db.sharding import Database
 from environment import Environment
 from redis_repository.redis_repository import RedisRepository
 
 
-def init_authorization_handlers(dp: Dispatcher, db: DbFunctions, _env: Environment, redis: RedisRepository):
+def init_authorization_handlers(dp: Dispatcher, db: Database, _env: Environment, redis: RedisRepository):
 
     async def _start_handler(message: types.Message, state: FSMContext):
         await state.reset_state()
@@ -50,7 +50,7 @@ def init_authorization_handlers(dp: Dispatcher, db: DbFunctions, _env: Environme
         state_data: dict = dict(await state.get_data())
         email = state_data.get("email_check")
         try:
-            response: str = db.find_user_by_email(email)
+            response: str = db.for_user(callback.message.chat.id).find_user_by_email(email)
             if email == response:
                 user_id: Integer = callback.message.chat.id
                 await state.finish()
@@ -0,0 +1,38 @@
+import logging
+
+from aiogram import types
+from aiogram.dispatcher import Dispatcher
+
+from app.conversation.dialogs.dialogs import msg
+from app.services.budget import BudgetTracker
+from app.tools.money import MAX_MINOR_UNITS, AmountTooLarge, format_amount, parse_amount
+from db.sharding import Database
+from environment import Environment
+from middlewares.throttling import throttling_cost
+
+
+def init_budget_handler(dp: Dispatcher, db: Database, _env: Environment, budget_tracker: BudgetTracker):
+    logger = logging.getLogger(__name__)
+    logger.info("Start budget handler")
+
+    @dp.message_handler(commands={"budget"}, state="*")
+    @throttling_cost(3)
+    async def set_budget(message: types.Message):
+        try:
+            limit_sum, category = message.get_args().split(" ")
+            limit_sum = parse_amount(limit_sum)
+        except AmountTooLarge:
+            await message.answer(text=msg.amount_too_large.format(max_amount=format_amount(MAX_MINOR_UNITS)))
+            return
+        except ValueError:
+            await message.answer(text=msg.set_budget)
+            return
+
+        try:
+            category_id = db.for_user(message.from_user.id).check_category(category)
+        except TypeError:
+            await message.answer(text="Введенной категории нет в базе данных")
+            return
+
+        await budget_tracker.set_budget(telegram_id=message.from_user.id, category_id=category_id, limit_sum=limit_sum)
+        await message.answer(text=msg.budget_saved.format(category=category, limit_sum=format_amount(limit_sum)))
@@ -1,5 +1,5 @@
 import logging
-from os import path
+from typing import Optional
 
 from aiogram import types
 from aiogram.dispatcher import Dispatcher, FSMContext
@@ -7,14 +7,20 @@ from aiogram.dispatcher import Dispatcher, FSMContext
 from app.conversation.dialogs.buttons import MenuButtons
 from app.conversation.dialogs.dialogs import buttons_names, msg
 from app.conversation.states.expenses_state import ExpensesInsertState
-from db.db_functions import DbFunctions
+from app.services.budget import BudgetTracker
+from app.services.dimensions import DimensionsCache
+from app.services.expenses_stream import ExpensesStream
+from app.tools.money import MAX_MINOR_UNITS, AmountTooLarge, format_amount, parse_amount
+from db.sharding import Database
 from environment import Environment
+from middlewares.throttling import throttling_cost
 from redis_repository.redis_repository import RedisRepository
 
 
-def init_expenses_handler(dp: Dispatcher, db: DbFunctions, _env: Environment, redis: RedisRepository):
-    log_file_path = path.join(path.dirname(path.abspath("__file__")), "logging.ini")
-    logging.config.fileConfig(log_file_path, disable_existing_loggers=False)
+def init_expenses_handler(dp: Dispatcher, db: Database, _env: Environment, redis: RedisRepository,
+                          budget_tracker: BudgetTracker, dimensions: DimensionsCache,
+                          expenses_stream: Optional[ExpensesStream] = None):
+    """With expenses_stream expenses are written to redis stream and inserted into database by flusher"""
     logger = logging.getLogger(__name__)
     logger.info("Start expenses_insert handler")
 
@@ -41,28 +47,44 @@ def init_expenses_handler(dp: Dispatcher, db: DbFunctions, _env: Environment, re
 
     @dp.message_handler(lambda m: m.text not in buttons_names.__dict__.values(),
                         state=ExpensesInsertState.expenses_string)
+    @throttling_cost(4)
     async def expenses_insert(message: types.Message, state: FSMContext):
         spending_sum, currency, category = message.text.split(" ")
+        currency_row = dimensions.get_currency(currency)
+        if not currency_row:
+            await message.answer(text="Введенной валюты нет в базе данных")
+            await go_to_main_menu(message, state)
+            return
+
+        currency_id, scale = currency_row
         try:
-            spending_sum = int(spending_sum)
+            spending_sum = parse_amount(spending_sum, scale)
+        except AmountTooLarge:
+            await message.answer(text=msg.amount_too_large.format(max_amount=format_amount(MAX_MINOR_UNITS, scale)))
+            return
         except ValueError:
             await message.answer(text="Введенная сумма не является числом")
-            await start_expenses_insert
-            return
-
-        currency_id = db.check_currency(currency)
-        if not currency_id:
-            await message.answer(text="Введенной валюты нет в базе данных")
-            await go_to_main_menu(message, state)
             return
 
-        category_id = db.check_category(category)
+        category_id = dimensions.get_category_id(category)
         if not category_id:
             await message.answer(text="Введенной категории нет в базе данных")
             await go_to_main_menu(message, state)
             return
 
-        telegram_id = db.get_user_id_by_telegram_id(telegram_id=message.from_user.id)
-        db.insert_expense(spending_sum, currency_id, category_id, telegram_id)
+        if expenses_stream is not None:
+            alert = await expenses_stream.add_expense(
+                telegram_id=message.from_user.id, ingest_key=f"{message.chat.id}:{message.message_id}",
+                spending_sum=spending_sum, currency_id=currency_id, category_id=category_id)
+        else:
+            user_db = db.for_user(message.from_user.id)
+            telegram_id = user_db.get_user_id_by_telegram_id(telegram_id=message.from_user.id)
+            user_db.insert_expense(spending_sum, currency_id, category_id, telegram_id)
+            alert = await budget_tracker.add_expense(telegram_id=message.from_user.id, category_id=category_id,
+                                                     spending_sum=spending_sum)
 
         await message.answer("Расходы внесены")
+        if alert:
+            text = msg.budget_exceeded if alert.threshold >= 1 else msg.budget_warning
+            await message.answer(text.format(category=category, total=format_amount(alert.total),
+                                             limit_sum=format_amount(alert.limit_sum)))
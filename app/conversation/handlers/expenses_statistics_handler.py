@@ -0,0 +1,80 @@
+import asyncio
+import datetime
+import logging
+from typing import List, Tuple
+
+from aiogram import types
+from aiogram.dispatcher import Dispatcher
+
+from app.conversation.dialogs.buttons import StatisticsButtons
+from app.conversation.dialogs.dialogs import buttons_callbacks, msg
+from app.services.charts import ChartService
+from app.tools.charts import BAR, PIE
+from db.sharding import Database
+from environment import Environment
+from middlewares.throttling import throttling_cost
+from redis_repository.async_cache import AsyncCache
+
+
+def init_expenses_statistics_handler(dp: Dispatcher, db: Database, _env: Environment,
+                                     chart_service: ChartService, cache: AsyncCache):
+    logger = logging.getLogger(__name__)
+    logger.info("Start expenses_statistics handler")
+
+    def _categories_chart_data(telegram_id: int, date_from: datetime.date,
+                               date_to: datetime.date) -> Tuple[List[str], List[float]]:
+        user_db = db.for_user(telegram_id)
+        user_id = user_db.get_user_id_by_telegram_id(telegram_id=telegram_id)
+        rows = user_db.get_expenses_sum_by_category(user_id=user_id, date_from=date_from, date_to=date_to)
+        labels = [f"{category_name}, {currency_name}" for category_name, currency_name, _ in rows]
+        return labels, [expenses_sum for *_, expenses_sum in rows]
+
+    def _days_chart_data(telegram_id: int, date_from: datetime.date,
+                         date_to: datetime.date) -> Tuple[List[str], List[float]]:
+        user_db = db.for_user(telegram_id)
+        user_id = user_db.get_user_id_by_telegram_id(telegram_id=telegram_id)
+        rows = user_db.get_expenses_sum_by_day(user_id=user_id, date_from=date_from, date_to=date_to)
+        return [created_at.strftime("%d.%m") for created_at, _ in rows], [expenses_sum for _, expenses_sum in rows]
+
+    async def get_chart_data(query, telegram_id: int, date_from: datetime.date, date_to: datetime.date):
+        """Chart data from cache. Query runs in thread once for concurrent requests of the same chart"""
+        async def compute():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, query, telegram_id, date_from, date_to)
+
+        key = f"chart_data:{query.__name__}:{telegram_id}:{date_from}:{date_to}"
+        return await cache.get_or_compute(key, compute, ex=_env.report_cache_ttl)
+
+    @dp.message_handler(commands={"charts"}, state="*")
+    async def choose_chart(message: types.Message):
+        await message.answer(msg.choose_chart, reply_markup=StatisticsButtons.charts_kb())
+
+    @dp.callback_query_handler(lambda c: c.data in (buttons_callbacks.chart_categories_week,
+                                                    buttons_callbacks.chart_categories_month), state="*")
+    @throttling_cost(3)
+    async def categories_chart(callback: types.CallbackQuery):
+        await callback.answer()
+        today = datetime.date.today()
+        if callback.data == buttons_callbacks.chart_categories_week:
+            title, date_from = msg.chart_categories_week, today - datetime.timedelta(days=today.weekday())
+        else:
+            title, date_from = msg.chart_categories_month, today.replace(day=1)
+
+        labels, values = await get_chart_data(_categories_chart_data, callback.from_user.id, date_from, today)
+        if not labels:
+            await callback.message.answer(msg.no_expenses_for_period)
+            return
+        await chart_service.send_chart(bot=dp.bot, chat_id=callback.message.chat.id, kind=PIE, title=title,
+                                       labels=labels, values=values)
+
+    @dp.callback_query_handler(lambda c: c.data == buttons_callbacks.chart_days_month, state="*")
+    @throttling_cost(3)
+    async def days_chart(callback: types.CallbackQuery):
+        await callback.answer()
+        today = datetime.date.today()
+        labels, values = await get_chart_data(_days_chart_data, callback.from_user.id, today.replace(day=1), today)
+        if not labels:
+            await callback.message.answer(msg.no_expenses_for_period)
+            return
+        await chart_service.send_chart(bot=dp.bot, chat_id=callback.message.chat.id, kind=BAR,
+                                       title=msg.chart_days_month, labels=labels, values=values)
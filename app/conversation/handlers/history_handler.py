@@ -0,0 +1,74 @@
+import asyncio
+import datetime
+import logging
+from typing import Any, List, Optional, Tuple
+
+from aiogram import types
+from aiogram.dispatcher import Dispatcher
+
+from app.conversation.dialogs.buttons import HistoryButtons
+from app.conversation.dialogs.dialogs import buttons_callbacks, buttons_names, msg
+from app.tools.money import format_amount
+from db.sharding import Database
+from environment import Environment
+
+Cursor = Tuple[datetime.date, int]
+
+
+def _encode_cursor(direction: str, row: Tuple[Any, ...]) -> str:
+    expense_id, created_at, *_ = row
+    return f"{direction}:{created_at.isoformat()}:{expense_id}"
+
+
+def _decode_cursor(data: str) -> Optional[Tuple[str, Cursor]]:
+    try:
+        direction, created_at, expense_id = data.split(":")
+        return direction, (datetime.date.fromisoformat(created_at), int(expense_id))
+    except ValueError:
+        return None
+
+
+def init_history_handler(dp: Dispatcher, db: Database, _env: Environment):
+    """Expenses history by pages from newest to oldest. Cursor of page is in callback data of buttons"""
+    logger = logging.getLogger(__name__)
+    logger.info("Start history handler")
+
+    def _get_page(telegram_id: int, cursor: Optional[Cursor], newer: bool) -> Tuple[List[Tuple[Any, ...]], bool]:
+        user_db = db.for_user(telegram_id)
+        user_id = user_db.get_user_id_by_telegram_id(telegram_id=telegram_id)
+        return user_db.get_expenses_page(user_id=user_id, limit=_env.history_page_size, cursor=cursor, newer=newer)
+
+    async def _render_page(telegram_id: int, cursor: Optional[Cursor] = None, newer: bool = False):
+        loop = asyncio.get_running_loop()
+        rows, has_more = await loop.run_in_executor(None, _get_page, telegram_id, cursor, newer)
+        if not rows:
+            return None, None
+
+        has_newer = has_more if newer else cursor is not None
+        has_older = True if newer else has_more
+        lines = [msg.expenses_history]
+        lines += [f"{created_at.strftime('%d.%m.%Y')} {category_name} {format_amount(expenses_sum, scale)} "
+                  f"{currency_name}" for _, created_at, category_name, currency_name, expenses_sum, scale in rows]
+        kb = HistoryButtons.pages_kb(
+            newer_data=_encode_cursor(buttons_callbacks.history_newer, rows[0]) if has_newer else None,
+            older_data=_encode_cursor(buttons_callbacks.history_older, rows[-1]) if has_older else None)
+        return "\n".join(lines), kb
+
+    @dp.message_handler(lambda m: m.text == buttons_names.expenses_history, state="*")
+    @dp.message_handler(commands={"history"}, state="*")
+    async def show_history(message: types.Message):
+        text, kb = await _render_page(message.from_user.id)
+        await message.answer(text or msg.expenses_history_empty, reply_markup=kb)
+
+    @dp.callback_query_handler(lambda c: c.data.startswith((f"{buttons_callbacks.history_newer}:",
+                                                             f"{buttons_callbacks.history_older}:")), state="*")
+    async def turn_page(callback: types.CallbackQuery):
+        await callback.answer()
+        decoded = _decode_cursor(callback.data)
+        if decoded is None:
+            return
+        direction, cursor = decoded
+        text, kb = await _render_page(callback.from_user.id, cursor=cursor,
+                                      newer=direction == buttons_callbacks.history_newer)
+        if text:
+            await callback.message.edit_text(text, reply_markup=kb)
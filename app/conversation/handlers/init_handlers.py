@@ -1,26 +1,54 @@
 import logging
-from os import path
+from typing import Optional
 
 from aiogram.dispatcher import Dispatcher
-from aiogram.contrib.middlewares.logging import LoggingMiddleware
 
+from app.conversation.handlers.analytics_handler import init_analytics_handler
 from app.conversation.handlers.authorization_handler import init_authorization_handlers
+from app.conversation.handlers.budget_handler import init_budget_handler
 from app.conversation.handlers.expenses_insert_handler import init_expenses_handler
-from db.db_functions import DbFunctions
+from app.conversation.handlers.expenses_statistics_handler import init_expenses_statistics_handler
+from app.conversation.handlers.history_handler import init_history_handler
+from app.conversation.handlers.jobs_handler import init_jobs_handler
+from app.services.analytics import SpendingAnalytics
+from app.services.budget import BudgetTracker
+from app.services.charts import ChartService
+from app.services.dimensions import DimensionsCache
+from app.services.expenses_stream import ExpensesStream
+from app.services.jobs import JobQueue
+from db.db_functions import PoolExhausted
+from db.sharding import Database
 from middlewares.authentication import AuthenticationMiddleware
+from middlewares.logging_context import LoggingContextMiddleware
+from middlewares.throttling import ThrottlingMiddleware
 
+from redis_repository.async_cache import AsyncCache
 from redis_repository.redis_repository import RedisRepository
+from redis_repository.throttling_repository import ThrottlingRepository
 from environment import Environment
 
 
-def init_handlers(dp: Dispatcher, db: DbFunctions, env: Environment,
-                  redis: RedisRepository):
-    log_file_path = path.join(path.dirname(path.abspath("__file__")), "logging.ini")
-    logging.config.fileConfig(log_file_path, disable_existing_loggers=False)
+def init_handlers(dp: Dispatcher, db: Database, env: Environment,
+                  redis: RedisRepository, budget_tracker: BudgetTracker, chart_service: ChartService,
+                  throttling_repository: ThrottlingRepository, dimensions: DimensionsCache,
+                  cache: AsyncCache, analytics: SpendingAnalytics, job_queue: JobQueue,
+                  expenses_stream: Optional[ExpensesStream] = None):
     logger = logging.getLogger(__name__)
     logger.info("Start expenses_insert handler")
 
-    dp.middleware.setup(LoggingMiddleware())
+    dp.middleware.setup(LoggingContextMiddleware())
+    throttling = ThrottlingMiddleware(throttling_repository=throttling_repository, db=db,
+                                      db_wait_threshold=env.throttling_db_wait_threshold,
+                                      heavy_cost=env.throttling_heavy_cost)
+    dp.middleware.setup(throttling)
+    dp.register_errors_handler(throttling.on_pool_exhausted, exception=PoolExhausted)
     dp.middleware.setup(AuthenticationMiddleware(redis_repository=redis))
     init_authorization_handlers(dp=dp, db=db, _env=env, redis=redis)
-    init_expenses_handler(dp=dp, db=db, _env=env, redis=redis)
+    init_budget_handler(dp=dp, db=db, _env=env, budget_tracker=budget_tracker)
+    init_expenses_statistics_handler(dp=dp, db=db, _env=env, chart_service=chart_service,
+                                     cache=cache)
+    init_analytics_handler(dp=dp, _env=env, analytics=analytics)
+    init_jobs_handler(dp=dp, _env=env, job_queue=job_queue)
+    init_history_handler(dp=dp, db=db, _env=env)
+    init_expenses_handler(dp=dp, db=db, _env=env, redis=redis, budget_tracker=budget_tracker, dimensions=dimensions,
+                          expenses_stream=expenses_stream)
@@ -0,0 +1,31 @@
+import datetime
+import logging
+
+from aiogram import types
+from aiogram.dispatcher import Dispatcher
+
+from app.conversation.dialogs.dialogs import msg
+from app.services.jobs import JobQueue
+from app.services.report_jobs import EXPORT, EXPORT_PRIORITY, YEAR_REPORT, YEAR_REPORT_PRIORITY
+from environment import Environment
+
+
+def init_jobs_handler(dp: Dispatcher, _env: Environment, job_queue: JobQueue):
+    """Heavy reports are prepared by jobs worker, handlers only put them into queue"""
+    logger = logging.getLogger(__name__)
+    logger.info("Start jobs handler")
+
+    async def _enqueue(message: types.Message, kind: str, payload: dict, priority: int):
+        if await job_queue.enqueue(kind=kind, telegram_id=message.from_user.id, chat_id=message.chat.id,
+                                   payload=payload, priority=priority):
+            await message.answer(msg.job_preparing)
+        else:
+            await message.answer(msg.job_already_preparing)
+
+    @dp.message_handler(commands={"year_report"}, state="*")
+    async def year_report(message: types.Message):
+        await _enqueue(message, YEAR_REPORT, {"year": datetime.date.today().year}, YEAR_REPORT_PRIORITY)
+
+    @dp.message_handler(commands={"export"}, state="*")
+    async def export(message: types.Message):
+        await _enqueue(message, EXPORT, {}, EXPORT_PRIORITY)
@@ -0,0 +1,152 @@
+"""Spending analytics of one user on NumPy arrays.
+
+Daily totals of user are loaded with one query and kept as matrix categories x days in major units.
+Every metric is computed by array operations over the whole matrix, rolling means are differences of
+cumulative sums. Matrices are kept in memory for cache_ttl seconds.
+"""
+import asyncio
+import datetime
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import numpy as np
+
+from db.sharding import Database
+
+ANOMALY_WINDOW = 30
+ANOMALY_SIGMAS = 3.0
+RECENT_DAYS = 7
+
+
+@dataclass
+class UserSpending:
+    labels: List[str]
+    daily: np.ndarray
+    days: np.ndarray
+    months: np.ndarray
+    days_of_month: np.ndarray
+
+    @property
+    def last_day(self) -> datetime.date:
+        return self.days[-1].astype(datetime.date)
+
+
+@dataclass
+class SpendingReport:
+    labels: List[str]
+    avg_7: np.ndarray
+    avg_30: np.ndarray
+    month_to_date: np.ndarray
+    month_change: np.ndarray
+    year_change: np.ndarray
+    top: List[int]
+    anomalies: List[Tuple[str, datetime.date, float]]
+
+
+def daily_matrix(rows: List[Tuple], date_from: datetime.date, date_to: datetime.date) -> UserSpending:
+    """UserSpending from rows of DbFunctions.get_daily_totals_by_category"""
+    days = np.arange(np.datetime64(date_from, "D"), np.datetime64(date_to, "D") + 1)
+    daily = np.zeros((len(rows), len(days)))
+    labels = []
+    for index, (category_name, currency_name, scale, offsets, totals) in enumerate(rows):
+        daily[index, offsets] = np.asarray(totals, dtype=np.float64) / 10 ** scale
+        labels.append(f"{category_name}, {currency_name}")
+    months = days.astype("datetime64[M]")
+    days_of_month = (days - months.astype("datetime64[D]")).astype(np.int64) + 1
+    return UserSpending(labels=labels, daily=daily, days=days, months=months, days_of_month=days_of_month)
+
+
+def rolling_mean(daily: np.ndarray, window: int) -> np.ndarray:
+    """Mean of last window days for every day, days before the first one count as zero"""
+    cumsum = np.cumsum(daily, axis=1)
+    shifted = np.zeros_like(cumsum)
+    shifted[:, window:] = cumsum[:, :-window]
+    return (cumsum - shifted) / window
+
+
+def find_anomalies(daily: np.ndarray, window: int = ANOMALY_WINDOW, sigmas: float = ANOMALY_SIGMAS) -> np.ndarray:
+    """Flags of days with total above mean + sigmas * std of previous window days and at least twice the mean"""
+    mean = rolling_mean(daily, window)
+    std = np.sqrt(np.maximum(rolling_mean(daily ** 2, window) - mean ** 2, 0))
+    previous_mean, previous_std = np.zeros_like(mean), np.zeros_like(std)
+    previous_mean[:, 1:], previous_std[:, 1:] = mean[:, :-1], std[:, :-1]
+    flags = (previous_mean > 0) & (daily > previous_mean + np.maximum(sigmas * previous_std, previous_mean))
+    # not enough history for the first days
+    flags[:, :window] = False
+    return flags
+
+
+def period_to_date(spending: UserSpending, months_back: int) -> np.ndarray:
+    """Totals from the first day of month months_back months ago to the same day of month as last day"""
+    last_month = spending.months[-1]
+    mask = (spending.months == last_month - months_back) & (spending.days_of_month <= spending.days_of_month[-1])
+    return spending.daily[:, mask].sum(axis=1)
+
+
+def relative_change(current: np.ndarray, previous: np.ndarray) -> np.ndarray:
+    """current / previous - 1, nan where there was nothing to compare with"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(previous > 0, current / previous - 1, np.nan)
+
+
+def analyze(spending: UserSpending, top_n: int = 5) -> SpendingReport:
+    month_to_date = period_to_date(spending, months_back=0)
+    top = np.argsort(-month_to_date, kind="stable")[:top_n]
+
+    flags = find_anomalies(spending.daily)[:, -RECENT_DAYS:]
+    categories, days = np.nonzero(flags)
+    recent_days = spending.days[-RECENT_DAYS:]
+    recent_daily = spending.daily[:, -RECENT_DAYS:]
+    anomalies = [
+        (spending.labels[category], recent_days[day].astype(datetime.date), float(recent_daily[category, day]))
+        for category, day in zip(categories, days)
+    ]
+
+    return SpendingReport(
+        labels=spending.labels,
+        avg_7=rolling_mean(spending.daily, 7)[:, -1],
+        avg_30=rolling_mean(spending.daily, 30)[:, -1],
+        month_to_date=month_to_date,
+        month_change=relative_change(month_to_date, period_to_date(spending, months_back=1)),
+        year_change=relative_change(month_to_date, period_to_date(spending, months_back=12)),
+        top=[int(index) for index in top if month_to_date[index] > 0],
+        anomalies=anomalies,
+    )
+
+
+class SpendingAnalytics:
+
+    def __init__(self, db: Database, history_days: int, cache_ttl: int, cache_size: int):
+        self.db = db
+        self.history_days = history_days
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[int, Tuple[float, UserSpending]]" = OrderedDict()
+
+    def _load(self, telegram_id: int, today: datetime.date) -> UserSpending:
+        user_db = self.db.for_user(telegram_id)
+        user_id = user_db.get_user_id_by_telegram_id(telegram_id=telegram_id)
+        date_from = today - datetime.timedelta(days=self.history_days)
+        rows = user_db.get_daily_totals_by_category(user_id=user_id, date_from=date_from, date_to=today)
+        return daily_matrix(rows, date_from, today)
+
+    async def get_spending(self, telegram_id: int) -> UserSpending:
+        """Daily totals of user up to today from cache or database"""
+        today = datetime.date.today()
+        cached = self._cache.get(telegram_id)
+        if cached and time.monotonic() - cached[0] < self.cache_ttl and cached[1].last_day == today:
+            self._cache.move_to_end(telegram_id)
+            return cached[1]
+
+        loop = asyncio.get_running_loop()
+        spending = await loop.run_in_executor(None, self._load, telegram_id, today)
+        self._cache[telegram_id] = (time.monotonic(), spending)
+        self._cache.move_to_end(telegram_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return spending
+
+    async def get_report(self, telegram_id: int, top_n: int = 5) -> SpendingReport:
+        return analyze(await self.get_spending(telegram_id), top_n=top_n)
@@ -0,0 +1,106 @@
+import asyncio
+import datetime
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from aioredis.client import Pipeline
+
+from db.sharding import Database
+from redis_repository.budget_repository import BudgetRepository
+from redis_repository.expenses_stream_repository import ExpensesStreamRepository
+
+ALERT_THRESHOLDS = (0.8, 1.0)
+
+
+@dataclass(frozen=True)
+class BudgetAlert:
+    threshold: float
+    total: int
+    limit_sum: int
+
+
+class BudgetTracker:
+    """Keeps monthly running totals in redis next to every expense insert and checks budget limits.
+    Sums are in minor units.
+
+    Totals are keyed by month, so new month starts from empty keys and old ones expire.
+    Periodic reconciliation corrects redis totals by sums from database plus expenses still waiting
+    in write-behind stream. Totals are read before database, so expenses added meanwhile are never dropped,
+    at worst they are counted twice until next reconciliation.
+    """
+
+    def __init__(self, db: Database, budget_repository: BudgetRepository,
+                 stream_repository: Optional[ExpensesStreamRepository] = None):
+        self.db = db
+        self.budget_repository = budget_repository
+        self.stream_repository = stream_repository
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def current_period(today: Optional[datetime.date] = None) -> str:
+        return (today or datetime.date.today()).strftime("%Y-%m")
+
+    async def add_expense(self, telegram_id: int, category_id: int, spending_sum: int) -> Optional[BudgetAlert]:
+        """Adds expense to running total. Returns alert if expense crosses one of ALERT_THRESHOLDS of limit"""
+        total, limit_sum = await self.budget_repository.add_expense(
+            telegram_id=telegram_id, category_id=category_id, period=self.current_period(), spending_sum=spending_sum)
+        return self.check_alert(total, limit_sum, spending_sum)
+
+    def add_expense_to_pipeline(self, pipe: Pipeline, telegram_id: int, category_id: int, spending_sum: int):
+        """The same as add_expense, but commands are queued to pipeline. Result is checked by check_alert"""
+        self.budget_repository.add_expense_to_pipeline(
+            pipe, telegram_id=telegram_id, category_id=category_id, period=self.current_period(),
+            spending_sum=spending_sum)
+
+    @staticmethod
+    def check_alert(total: int, limit_sum: Optional[int], spending_sum: int) -> Optional[BudgetAlert]:
+        if not limit_sum:
+            return None
+        previous_total = total - spending_sum
+        crossed = [t for t in ALERT_THRESHOLDS if previous_total < t * limit_sum <= total]
+        if not crossed:
+            return None
+        return BudgetAlert(threshold=crossed[-1], total=total, limit_sum=limit_sum)
+
+    async def set_budget(self, telegram_id: int, category_id: int, limit_sum: int):
+        db = self.db.for_user(telegram_id)
+        user_id = db.get_user_id_by_telegram_id(telegram_id=telegram_id)
+        db.set_budget(user_id=user_id, category_id=category_id, limit_sum=limit_sum)
+        await self.budget_repository.set_limit(telegram_id=telegram_id, category_id=category_id, limit_sum=limit_sum)
+
+    async def _stream_totals(self, period: str) -> Dict[Tuple[int, int], int]:
+        """Sums of expenses of period in write-behind stream by (telegram_id, category_id)"""
+        totals = defaultdict(int)
+        if self.stream_repository is None:
+            return totals
+        for _, fields in await self.stream_repository.entries():
+            try:
+                if fields[b"created_at"].decode().startswith(period):
+                    totals[(int(fields[b"telegram_id"]), int(fields[b"category_id"]))] += int(fields[b"expenses_sum"])
+            except (KeyError, ValueError):
+                continue
+        return totals
+
+    async def reconcile(self):
+        """Corrects redis totals and overwrites limits by current month sums from database"""
+        period = self.current_period()
+        loop = asyncio.get_running_loop()
+        snapshot = await self.budget_repository.get_totals(period)
+        # read before database, so entry inserted meanwhile is counted twice instead of not at all
+        stream_totals = await self._stream_totals(period)
+        for shard in self.db.shards:
+            rows = await loop.run_in_executor(None, shard.get_budget_totals_for_current_month)
+            rows = [(telegram_id, category_id, limit_sum, int(total) + stream_totals.get((telegram_id, category_id), 0))
+                    for telegram_id, category_id, limit_sum, total in rows]
+            await self.budget_repository.reconcile_totals(period=period, rows=rows, snapshot=snapshot)
+            self.logger.info(f"Budgets reconciled: {len(rows)} for period {period}")
+
+    async def run_reconciliation(self, interval: int):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as err:
+                self.logger.exception(err)
+            await asyncio.sleep(interval)
@@ -0,0 +1,60 @@
+import asyncio
+import hashlib
+import json
+import logging
+from concurrent.futures import Executor
+from io import BytesIO
+from typing import Dict, List
+
+from aiogram import Bot
+from aiogram.types import InputFile
+
+from app.tools.charts import render_chart
+from redis_repository.chart_repository import ChartRepository
+
+
+def chart_digest(kind: str, title: str, labels: List[str], values: List[float]) -> str:
+    """Content address of chart. The same aggregated data always gives the same chart"""
+    payload = json.dumps([kind, title, labels, [float(v) for v in values]], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ChartService:
+    """Sends charts to chat. Rendering goes to process pool, rendered images and uploaded file_id are cached"""
+
+    def __init__(self, executor: Executor, chart_repository: ChartRepository):
+        self.executor = executor
+        self.chart_repository = chart_repository
+        self._rendering: Dict[str, asyncio.Future] = {}
+        self.logger = logging.getLogger(__name__)
+
+    async def get_image(self, digest: str, kind: str, title: str, labels: List[str], values: List[float]) -> bytes:
+        image = await self.chart_repository.get_image(digest)
+        if image is not None:
+            return image
+
+        # the same chart requested concurrently is rendered once
+        if digest in self._rendering:
+            return await asyncio.shield(self._rendering[digest])
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, render_chart, kind, title, labels, values)
+        self._rendering[digest] = future
+        try:
+            image = await future
+        finally:
+            self._rendering.pop(digest, None)
+        await self.chart_repository.set_image(digest, image)
+        return image
+
+    async def send_chart(self, bot: Bot, chat_id: int, kind: str, title: str, labels: List[str],
+                         values: List[float]):
+        digest = chart_digest(kind, title, labels, values)
+        file_id = await self.chart_repository.get_file_id(digest)
+        if file_id is not None:
+            await bot.send_photo(chat_id=chat_id, photo=file_id)
+            return
+
+        image = await self.get_image(digest, kind, title, labels, values)
+        message = await bot.send_photo(chat_id=chat_id, photo=InputFile(BytesIO(image), filename=f"{digest}.png"))
+        await self.chart_repository.set_file_id(digest, message.photo[-1].file_id)
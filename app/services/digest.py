@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import datetime
+import logging
+import random
+import time
+from dataclasses import dataclass
+from itertools import groupby
+from operator import itemgetter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from aiogram import Bot
+from aiogram.utils.exceptions import BotBlocked, ChatNotFound, RetryAfter, TelegramAPIError, UserDeactivated
+
+from app.conversation.dialogs.dialogs import msg
+from app.tools.money import format_amount
+from app.tools.rate_limiter import AsyncRateLimiter
+from db.sharding import Database
+from redis_repository.digest_repository import DigestRepository
+
+WEEKLY = "weekly"
+MONTHLY = "monthly"
+SENT_TTL = 40 * 24 * 3600
+
+
+@dataclass(frozen=True)
+class DigestPeriod:
+    kind: str
+    date_from: datetime.date
+    date_to: datetime.date
+
+
+def get_digest_periods(today: datetime.date) -> List[DigestPeriod]:
+    """Weekly digest is sent on monday for previous week, monthly one on first day for previous month"""
+    periods = []
+    if today.weekday() == 0:
+        periods.append(DigestPeriod(WEEKLY, today - datetime.timedelta(days=7), today - datetime.timedelta(days=1)))
+    if today.day == 1:
+        last_day = today - datetime.timedelta(days=1)
+        periods.append(DigestPeriod(MONTHLY, last_day.replace(day=1), last_day))
+    return periods
+
+
+def render_digests(period: DigestPeriod, rows: Iterable[Tuple[Any, ...]]) -> Iterable[Tuple[int, str]]:
+    """Renders text for every user from rows (telegram_id, category_name, currency_name, scale, sum)
+    ordered by telegram_id. Sums are in minor units"""
+    title = msg.weekly_digest if period.kind == WEEKLY else msg.monthly_digest
+    title = title.format(date_from=period.date_from.strftime("%d.%m.%Y"), date_to=period.date_to.strftime("%d.%m.%Y"))
+    for telegram_id, user_rows in groupby(rows, key=itemgetter(0)):
+        lines = [title]
+        totals: Dict[Tuple[str, int], int] = {}
+        for _, category_name, currency_name, scale, expenses_sum in user_rows:
+            lines.append(f"{category_name}: {format_amount(expenses_sum, scale)} {currency_name}")
+            totals[(currency_name, scale)] = totals.get((currency_name, scale), 0) + expenses_sum
+        lines.append(msg.digest_total + ", ".join(
+            f"{format_amount(s, scale)} {currency}" for (currency, scale), s in totals.items()))
+        yield telegram_id, "\n".join(lines)
+
+
+class DigestScheduler:
+    """Sends weekly and monthly digests to all users with expenses in period.
+
+    Users are split into slots by telegram_id. Slots start one by one inside of a daily window,
+    every slot uses one grouped query and messages go through rate limiter. Users that got digest are saved
+    after every batch and slot is marked as sent when it is complete, so failed slot is resumed on next check
+    and restart of bot does not send the same digest twice. Dry run keeps sent slots only in memory.
+    """
+
+    def __init__(self, bot: Bot, db: Database, digest_repository: DigestRepository, slots: int, start_hour: int,
+                 window_minutes: int, messages_per_second: float, batch_size: int = 500, dry_run: bool = False):
+        self.bot = bot
+        self.db = db
+        self.digest_repository = digest_repository
+        self.slots = slots
+        self.start_hour = start_hour
+        self.window_minutes = window_minutes
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.limiter = AsyncRateLimiter(rate=messages_per_second, burst=max(1, int(messages_per_second)))
+        self._dry_run_sent: Set[Tuple[str, str, int]] = set()
+        self.logger = logging.getLogger(__name__)
+
+    def slot_start(self, day: datetime.date, slot: int) -> datetime.datetime:
+        start = datetime.datetime.combine(day, datetime.time(hour=self.start_hour))
+        return start + datetime.timedelta(minutes=self.window_minutes * slot / self.slots)
+
+    def due_slots(self, now: datetime.datetime) -> List[int]:
+        return [slot for slot in range(self.slots) if self.slot_start(now.date(), slot) <= now]
+
+    async def _is_slot_sent(self, period: DigestPeriod, slot: int) -> bool:
+        if self.dry_run:
+            return (period.kind, str(period.date_from), slot) in self._dry_run_sent
+        return await self.digest_repository.is_slot_sent(period.kind, str(period.date_from), slot)
+
+    async def _set_slot_sent(self, period: DigestPeriod, slot: int):
+        if self.dry_run:
+            self._dry_run_sent.add((period.kind, str(period.date_from), slot))
+        else:
+            await self.digest_repository.set_slot_sent(period.kind, str(period.date_from), slot)
+
+    async def run(self, check_interval: int = 60):
+        while True:
+            now = datetime.datetime.now()
+            for period in get_digest_periods(now.date()):
+                for slot in self.due_slots(now):
+                    try:
+                        if await self._is_slot_sent(period, slot):
+                            continue
+                        await self.send_slot(period, slot)
+                        await self._set_slot_sent(period, slot)
+                    except Exception as err:
+                        self.logger.exception(err)
+            await asyncio.sleep(check_interval)
+
+    async def send_slot(self, period: DigestPeriod, slot: int) -> int:
+        """Sends digests of slot to users that did not get it yet. Returns number of sent digests"""
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        sent_users = set()
+        if not self.dry_run:
+            sent_users = await self.digest_repository.get_sent_users(period.kind, str(period.date_from), slot)
+        sent = 0
+        batch = []
+        for shard in self.db.shards:
+            rows = await loop.run_in_executor(None, shard.get_expenses_totals_for_all_users,
+                                              period.date_from, period.date_to, self.slots, slot)
+            for telegram_id, text in render_digests(period, rows):
+                if telegram_id in sent_users:
+                    continue
+                batch.append((telegram_id, text))
+                if len(batch) >= self.batch_size:
+                    sent += await self._send_batch(period, slot, batch)
+                    batch = []
+        sent += await self._send_batch(period, slot, batch)
+        self.logger.info(f"Digest {period.kind} slot {slot}: {sent} sent in {time.monotonic() - started:.2f}s")
+        return sent
+
+    async def _send_batch(self, period: DigestPeriod, slot: int, batch: List[Tuple[int, str]]) -> int:
+        if self.dry_run:
+            return len(batch)
+        sent = 0
+        done = []
+        for telegram_id, text in batch:
+            if await self._send(telegram_id, text):
+                sent += 1
+            # users that blocked bot or failed are not tried again in this slot
+            done.append(telegram_id)
+        await self.digest_repository.add_sent_users(period.kind, str(period.date_from), slot, done)
+        return sent
+
+    async def _send(self, telegram_id: int, text: str) -> bool:
+        while True:
+            await self.limiter.acquire()
+            try:
+                await self.bot.send_message(chat_id=telegram_id, text=text)
+                return True
+            except RetryAfter as err:
+                await asyncio.sleep(err.timeout)
+            except (BotBlocked, ChatNotFound, UserDeactivated):
+                return False
+            except (TelegramAPIError, asyncio.TimeoutError) as err:
+                self.logger.warning(f"Digest is not sent to {telegram_id}: {err!r}")
+                return False
+
+
+def _synthetic_rows(users: int, categories: int) -> List[Tuple[Any, ...]]:
+    return [(telegram_id, f"category_{category}", "рублей", 2, random.randint(1, 1000000))
+            for telegram_id in range(users) for category in range(random.randint(1, categories))]
+
+
+def dry_run(users: int, categories: int, slots: int, batch_size: int) -> Dict[str, Optional[float]]:
+    """Measures digest generation time for synthetic aggregates without database and telegram"""
+    period = get_digest_periods(datetime.date(2022, 8, 1))[-1]
+    rows = _synthetic_rows(users, categories)
+    started = time.perf_counter()
+    rendered = 0
+    for slot in range(slots):
+        slot_rows = [row for row in rows if row[0] % slots == slot]
+        batch = []
+        for digest in render_digests(period, slot_rows):
+            batch.append(digest)
+            if len(batch) >= batch_size:
+                rendered += len(batch)
+                batch = []
+        rendered += len(batch)
+    elapsed = time.perf_counter() - started
+    return {"users": rendered, "rows": len(rows), "seconds": elapsed,
+            "users_per_second": rendered / elapsed if elapsed else None}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Digest generation dry run")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--categories", type=int, default=8)
+    parser.add_argument("--slots", type=int, default=12)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    print(dry_run(users=args.users, categories=args.categories, slots=args.slots, batch_size=args.batch_size))
@@ -0,0 +1,38 @@
+import time
+from typing import Dict, Optional, Tuple
+
+from db.sharding import Database
+
+REFRESH_INTERVAL = 60
+
+
+class DimensionsCache:
+    """Currencies and categories in memory. Both tables are small and almost never change,
+    so expense message is checked without database. Unknown name reloads tables at most once per REFRESH_INTERVAL"""
+
+    def __init__(self, db: Database):
+        self.db = db
+        self._currencies: Dict[str, Tuple[int, int]] = {}
+        self._categories: Dict[str, int] = {}
+        self._loaded_at: Optional[float] = None
+
+    def _refresh(self):
+        # monotonic clock may be below REFRESH_INTERVAL right after boot, so first call always loads
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < REFRESH_INTERVAL:
+            return
+        # dimension tables are the same on every shard
+        db = self.db.shards[0]
+        self._currencies = {name: (currency_id, scale) for currency_id, name, scale in db.get_currencies()}
+        self._categories = {name: category_id for category_id, name in db.get_categories()}
+        self._loaded_at = time.monotonic()
+
+    def get_currency(self, currency_name: str) -> Optional[Tuple[int, int]]:
+        """Currency id and scale by currency_name. None if there is no such currency"""
+        if currency_name not in self._currencies:
+            self._refresh()
+        return self._currencies.get(currency_name)
+
+    def get_category_id(self, category_name: str) -> Optional[int]:
+        if category_name not in self._categories:
+            self._refresh()
+        return self._categories.get(category_name)
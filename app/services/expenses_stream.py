@@ -0,0 +1,193 @@
+"""Write-behind ingestion of expenses.
+
+Handler appends expense to redis stream together with budget running total in one round trip and answers
+at once. ExpensesFlusher drains the stream by consumer group and inserts every batch with one statement
+per shard. Entries are acknowledged only after they are found in database, ingest_key makes repeated insert
+of batch no-op. Failed entries are retried, after max_attempts deliveries they are inserted one by one,
+so one bad entry does not stop the stream, and entries that still fail go to dead letter stream.
+
+Flusher runs inside of bot process, or separately:
+
+    python -m app.services.expenses_stream
+"""
+import asyncio
+import datetime
+import logging
+import socket
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from aioredis import Redis
+from environs import Env
+
+from app.services.budget import BudgetAlert, BudgetTracker
+from db.sharding import Database, init_database
+from environment import init_environment, init_logging
+from redis_repository.expenses_stream_repository import Entry, ExpensesStreamRepository
+from redis_repository.redis import init_redis
+
+STALE_ENTRY_MS = 60_000
+
+
+class ExpensesStream:
+
+    def __init__(self, redis: Redis, stream_repository: ExpensesStreamRepository, budget_tracker: BudgetTracker):
+        self.redis = redis
+        self.stream_repository = stream_repository
+        self.budget_tracker = budget_tracker
+
+    async def add_expense(self, telegram_id: int, ingest_key: str, spending_sum: int, currency_id: int,
+                          category_id: int) -> Optional[BudgetAlert]:
+        """Appends expense to stream and adds it to budget running total. Returns budget alert"""
+        pipe = self.redis.pipeline(transaction=True)
+        self.stream_repository.add_to_pipeline(pipe, {
+            "telegram_id": str(telegram_id),
+            "ingest_key": ingest_key,
+            "expenses_sum": str(spending_sum),
+            "currency_id": str(currency_id),
+            "category_id": str(category_id),
+            "created_at": datetime.date.today().isoformat(),
+        })
+        self.budget_tracker.add_expense_to_pipeline(pipe, telegram_id=telegram_id, category_id=category_id,
+                                                    spending_sum=spending_sum)
+        results = await pipe.execute()
+        total, limit_sum = self.budget_tracker.budget_repository.parse_add_expense_result(results)
+        return self.budget_tracker.check_alert(total, limit_sum, spending_sum)
+
+
+class ExpensesFlusher:
+
+    def __init__(self, db: Database, stream_repository: ExpensesStreamRepository, batch_size: int,
+                 flush_interval_ms: int, max_attempts: int, consumer: Optional[str] = None,
+                 retry_interval: float = 5):
+        self.db = db
+        self.stream_repository = stream_repository
+        self.batch_size = batch_size
+        self.flush_interval_ms = flush_interval_ms
+        self.max_attempts = max_attempts
+        self.consumer = consumer or socket.gethostname()
+        self.retry_interval = retry_interval
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def _parse(entries: List[Entry]) -> Tuple[Dict[int, List[tuple]], Dict[str, Entry], List[Entry]]:
+        """Rows by telegram_id, entries by ingest_key and broken entries"""
+        rows, by_ingest_key, broken = defaultdict(list), {}, []
+        for entry in entries:
+            _, fields = entry
+            try:
+                telegram_id = int(fields[b"telegram_id"])
+                ingest_key = fields[b"ingest_key"].decode()
+                rows[telegram_id].append((
+                    int(fields[b"expenses_sum"]), int(fields[b"currency_id"]), int(fields[b"category_id"]),
+                    telegram_id, fields[b"created_at"].decode(), ingest_key,
+                ))
+                by_ingest_key[ingest_key] = entry
+            except (KeyError, ValueError):
+                broken.append(entry)
+        return rows, by_ingest_key, broken
+
+    def _insert(self, rows_by_user: Dict[int, List[tuple]]) -> Set[str]:
+        """Returns ingest keys of rows that are in database"""
+        by_shard = defaultdict(list)
+        for telegram_id, rows in rows_by_user.items():
+            by_shard[self.db.for_user(telegram_id)].extend(rows)
+        stored = set()
+        for shard, rows in by_shard.items():
+            stored |= shard.insert_expenses_batch(rows)
+        return stored
+
+    async def flush(self, entries: List[Entry]) -> List[Entry]:
+        """Inserts entries and acknowledges the ones that are in database. Returns entries that are not
+        in database, for example of users missing on shard, they stay pending"""
+        if not entries:
+            return []
+        rows, by_ingest_key, broken = self._parse(entries)
+        if broken:
+            self.logger.error(f"Broken expenses stream entries: {[entry_id for entry_id, _ in broken]}")
+            await self.stream_repository.dead_letter(broken, reason="broken")
+        loop = asyncio.get_running_loop()
+        stored = await loop.run_in_executor(None, self._insert, rows)
+        await self.stream_repository.ack([entry[0] for key, entry in by_ingest_key.items() if key in stored])
+        return [entry for key, entry in by_ingest_key.items() if key not in stored]
+
+    async def _flush_batch(self, entries: List[Entry]) -> bool:
+        """Flushes batch. Entries that failed max_attempts times are flushed one by one, the ones that
+        still fail are moved to dead letter stream. Returns False if some entries are not in database"""
+        try:
+            failed = await self.flush(entries)
+        except Exception as err:
+            self.logger.exception(err)
+            failed = entries
+        if not failed:
+            return True
+        self.logger.error(f"Expenses stream entries are not in database: {[entry_id for entry_id, _ in failed]}")
+
+        attempts = await self.stream_repository.delivery_counts([entry_id for entry_id, _ in failed])
+        for entry in failed:
+            if attempts.get(entry[0], 0) < self.max_attempts:
+                continue
+            try:
+                reason = "not stored" if await self.flush([entry]) else ""
+            except Exception as err:
+                reason = repr(err)
+            if reason:
+                self.logger.error(f"Expenses stream entry {entry[0]} is moved to dead letter stream: {reason}")
+                await self.stream_repository.dead_letter([entry], reason=reason)
+        return False
+
+    async def _collect_batch(self) -> List[Entry]:
+        """Reads entries until batch is full or flush interval is over"""
+        entries = []
+        deadline = time.monotonic() + self.flush_interval_ms / 1000
+        while len(entries) < self.batch_size:
+            remaining_ms = int((deadline - time.monotonic()) * 1000)
+            if remaining_ms <= 0:
+                break
+            entries += await self.stream_repository.read(self.consumer, count=self.batch_size - len(entries),
+                                                         block_ms=remaining_ms)
+        return entries
+
+    async def run(self):
+        await self.stream_repository.create_group()
+        while True:
+            try:
+                # not acknowledged entries of this consumer and stopped ones go first
+                entries = await self.stream_repository.read(self.consumer, count=self.batch_size, block_ms=0,
+                                                             pending=True)
+                if not entries:
+                    entries = await self.stream_repository.claim_stale(self.consumer, min_idle_ms=STALE_ENTRY_MS,
+                                                                       count=self.batch_size)
+                if not entries:
+                    entries = await self._collect_batch()
+                flushed = await self._flush_batch(entries)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.logger.exception(err)
+                flushed = False
+            if not flushed:
+                await asyncio.sleep(self.retry_interval)
+
+
+async def _run_flusher():
+    log_listener = init_logging(with_file=False)
+    environment = init_environment()
+    env = Env()
+    env.read_env()
+    redis = await init_redis(environment=environment)
+    stream_repository = ExpensesStreamRepository(redis=redis, stream=environment.expenses_stream,
+                                                 group=environment.expenses_stream_group,
+                                                 dead_letter_stream=environment.expenses_stream_dead_letter)
+    try:
+        await ExpensesFlusher(db=init_database(env), stream_repository=stream_repository,
+                              batch_size=environment.expenses_stream_batch_size,
+                              flush_interval_ms=environment.expenses_stream_flush_interval_ms,
+                              max_attempts=environment.expenses_stream_max_attempts).run()
+    finally:
+        log_listener.stop()
+
+
+if __name__ == '__main__':
+    asyncio.run(_run_flusher())
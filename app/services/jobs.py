@@ -0,0 +1,49 @@
+"""Background jobs for heavy reports.
+
+Handler enqueues job into redis and answers at once, app.services.jobs_worker executes job against
+database and sends result to chat. Identical jobs of user are deduplicated while one of them waits or runs.
+"""
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict
+
+import ujson
+from aiogram import Bot
+
+from db.sharding import Database
+from redis_repository.jobs_repository import JobsRepository
+
+
+@dataclass
+class Job:
+    job_id: str
+    kind: str
+    telegram_id: int
+    chat_id: int
+    payload: Dict[str, Any]
+    dedup_key: str
+
+    @classmethod
+    def from_fields(cls, fields: Dict[bytes, bytes]) -> "Job":
+        return cls(job_id=fields[b"job_id"].decode(), kind=fields[b"kind"].decode(),
+                   telegram_id=int(fields[b"telegram_id"]), chat_id=int(fields[b"chat_id"]),
+                   payload=ujson.loads(fields[b"payload"]), dedup_key=fields[b"dedup_key"].decode())
+
+
+JobHandler = Callable[[Bot, Database, Job], Awaitable[None]]
+
+
+class JobQueue:
+
+    def __init__(self, jobs_repository: JobsRepository, dedup_ttl: int):
+        self.jobs_repository = jobs_repository
+        self.dedup_ttl = dedup_ttl
+
+    async def enqueue(self, kind: str, telegram_id: int, chat_id: int, payload: Dict[str, Any],
+                      priority: int) -> bool:
+        """Returns False if the same job of user is already waiting or running"""
+        payload = ujson.dumps(payload, sort_keys=True)
+        return await self.jobs_repository.enqueue(
+            job_id=uuid.uuid4().hex, priority=priority, dedup_key=f"{kind}:{telegram_id}:{payload}",
+            dedup_ttl_ms=self.dedup_ttl * 1000,
+            fields={"kind": kind, "telegram_id": str(telegram_id), "chat_id": str(chat_id), "payload": payload})
@@ -0,0 +1,152 @@
+"""Worker of background jobs.
+
+Claims jobs in priority order and runs up to concurrency of them at once. Job that runs longer than timeout
+is reported to user as failed. Job of stopped worker goes back to queue when its lease expires.
+
+Worker runs next to bot, several processes per container with --processes:
+
+    python -m app.services.jobs_worker --processes 2
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+from typing import Dict
+
+from aiogram import Bot
+from aiogram.utils.exceptions import BotBlocked, ChatNotFound, RetryAfter, UserDeactivated
+from environs import Env
+
+from app.conversation.dialogs.dialogs import msg
+from app.services.jobs import Job, JobHandler
+from app.services.report_jobs import REPORT_JOBS
+from db.sharding import Database, init_database
+from environment import init_environment, init_logging
+from redis_repository.jobs_repository import JobsRepository
+from redis_repository.redis import init_redis
+
+REQUEUE_INTERVAL = 10
+LEASE_GRACE_MS = 30_000
+
+
+class JobWorker:
+
+    def __init__(self, bot: Bot, db: Database, jobs_repository: JobsRepository, handlers: Dict[str, JobHandler],
+                 concurrency: int, timeout: float, max_attempts: int, poll_interval: float, metrics_interval: int):
+        self.bot = bot
+        self.db = db
+        self.jobs_repository = jobs_repository
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.metrics_interval = metrics_interval
+        self.logger = logging.getLogger(__name__)
+
+    async def _notify(self, chat_id: int, text: str):
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text)
+        except RetryAfter as err:
+            await asyncio.sleep(err.timeout)
+            await self.bot.send_message(chat_id=chat_id, text=text)
+        except (BotBlocked, ChatNotFound, UserDeactivated):
+            pass
+
+    async def execute(self, job: Job) -> str:
+        handler = self.handlers.get(job.kind)
+        if handler is None:
+            self.logger.error(f"Unknown job kind {job.kind} of job {job.job_id}")
+            return "failed"
+        try:
+            await asyncio.wait_for(handler(self.bot, self.db, job), timeout=self.timeout)
+            return "done"
+        except asyncio.TimeoutError:
+            # query of timed out job keeps running in its thread until database returns
+            self.logger.warning(f"Job {job.kind} {job.job_id} timed out in {self.timeout}s")
+            await self._notify(job.chat_id, msg.job_timeout)
+            return "timeout"
+        except (BotBlocked, ChatNotFound, UserDeactivated):
+            return "done"
+        except Exception as err:
+            self.logger.exception(err)
+            await self._notify(job.chat_id, msg.job_failed)
+            return "failed"
+
+    async def _process_jobs(self):
+        lease_ms = int(self.timeout * 1000) + LEASE_GRACE_MS
+        while True:
+            try:
+                fields = await self.jobs_repository.claim(lease_ms)
+                if fields is None:
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+                job = Job.from_fields(fields)
+                status = await self.execute(job)
+                await self.jobs_repository.finish(job.job_id, job.dedup_key, status)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.logger.exception(err)
+                await asyncio.sleep(self.poll_interval)
+
+    async def _requeue_expired(self):
+        while True:
+            await asyncio.sleep(REQUEUE_INTERVAL)
+            try:
+                requeued = await self.jobs_repository.requeue_expired(self.max_attempts)
+                if requeued:
+                    self.logger.warning(f"{requeued} jobs of stopped workers are back in queue")
+            except Exception as err:
+                self.logger.exception(err)
+
+    async def _log_metrics(self):
+        while True:
+            await asyncio.sleep(self.metrics_interval)
+            try:
+                self.logger.info(f"Jobs: {await self.jobs_repository.metrics()}")
+            except Exception as err:
+                self.logger.exception(err)
+
+    async def run(self):
+        await asyncio.gather(self._requeue_expired(), self._log_metrics(),
+                             *(self._process_jobs() for _ in range(self.concurrency)))
+
+
+async def _run_worker():
+    log_listener = init_logging(with_file=False)
+    environment = init_environment()
+    env = Env()
+    env.read_env()
+    redis = await init_redis(environment=environment)
+    bot = Bot(token=environment.telegram_token)
+    worker = JobWorker(bot=bot, db=init_database(env), handlers=REPORT_JOBS,
+                       jobs_repository=JobsRepository(redis=redis, prefix=environment.jobs_prefix),
+                       concurrency=environment.jobs_concurrency, timeout=environment.jobs_timeout,
+                       max_attempts=environment.jobs_max_attempts,
+                       poll_interval=environment.jobs_poll_interval_ms / 1000,
+                       metrics_interval=environment.jobs_metrics_interval)
+    try:
+        await worker.run()
+    finally:
+        session = await bot.get_session()
+        await session.close()
+        log_listener.stop()
+
+
+def _start_worker():
+    asyncio.run(_run_worker())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Background jobs worker")
+    parser.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args()
+    if args.processes == 1:
+        _start_worker()
+    else:
+        processes = [multiprocessing.Process(target=_start_worker) for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
@@ -0,0 +1,72 @@
+"""Heavy reports executed by jobs worker"""
+import asyncio
+import csv
+import datetime
+from io import BytesIO, StringIO
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict
+
+from aiogram import Bot
+from aiogram.types import InputFile
+
+from app.conversation.dialogs.dialogs import msg
+from app.services.jobs import Job, JobHandler
+from app.tools.money import format_amount
+from db.sharding import Database
+
+YEAR_REPORT = "year_report"
+EXPORT = "export"
+
+# interactive report goes before exports waiting in queue
+YEAR_REPORT_PRIORITY = 5
+EXPORT_PRIORITY = 1
+
+
+def _year_report_text(db: Database, telegram_id: int, year: int) -> str:
+    user_db = db.for_user(telegram_id)
+    user_id = user_db.get_user_id_by_telegram_id(telegram_id=telegram_id)
+    date_from = datetime.date(year, 1, 1)
+    date_to = datetime.date(year, 12, 31)
+    by_category = user_db.get_expenses_sum_by_category(user_id=user_id, date_from=date_from, date_to=date_to)
+    if not by_category:
+        return msg.no_expenses_for_period
+    by_month = user_db.get_expenses_sum_by_month(user_id=user_id, date_from=date_from, date_to=date_to)
+
+    lines = [msg.year_report.format(year=year)]
+    lines += [f"{category_name}: {expenses_sum:.2f} {currency_name}"
+              for category_name, currency_name, expenses_sum in by_category]
+    lines.append(msg.year_report_by_month)
+    for month, rows in groupby(by_month, key=itemgetter(0)):
+        lines.append(f"{month.strftime('%m.%Y')}: " + ", ".join(
+            f"{expenses_sum:.2f} {currency_name}" for _, currency_name, expenses_sum in rows))
+    return "\n".join(lines)
+
+
+def _export_csv(db: Database, telegram_id: int) -> bytes:
+    user_db = db.for_user(telegram_id)
+    user_id = user_db.get_user_id_by_telegram_id(telegram_id=telegram_id)
+    output = StringIO()
+    writer = csv.writer(output)
+    writer.writerow(("date", "category", "currency", "sum"))
+    for created_at, category_name, currency_name, expenses_sum, scale in user_db.get_expenses_for_export(user_id):
+        writer.writerow((created_at.isoformat(), category_name, currency_name, format_amount(expenses_sum, scale)))
+    return output.getvalue().encode("utf-8-sig")
+
+
+async def year_report(bot: Bot, db: Database, job: Job):
+    loop = asyncio.get_running_loop()
+    text = await loop.run_in_executor(None, _year_report_text, db, job.telegram_id, job.payload["year"])
+    await bot.send_message(chat_id=job.chat_id, text=text)
+
+
+async def export(bot: Bot, db: Database, job: Job):
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(None, _export_csv, db, job.telegram_id)
+    await bot.send_document(chat_id=job.chat_id, document=InputFile(BytesIO(data), filename="expenses.csv"))
+
+
+REPORT_JOBS: Dict[str, JobHandler] = {
+    YEAR_REPORT: year_report,
+    EXPORT: export,
+}
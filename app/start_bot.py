@@ -1,16 +1,16 @@
+from typing import Type
+
 from aiogram import Bot
 from aiogram.utils.executor import Executor
-from aiogram.contrib.middlewares.logging import LoggingMiddleware
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import Dispatcher
 
 from environment import Environment
 
 
-def init_bot(environment: Environment):
-    bot = Bot(token=environment.telegram_token)
+def init_bot(environment: Environment, bot_class: Type[Bot] = Bot):
+    bot = bot_class(token=environment.telegram_token)
     dp = Dispatcher(bot, storage=MemoryStorage())
-    dp.middleware.setup(LoggingMiddleware())
 
     return bot, dp
 
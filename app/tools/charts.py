@@ -0,0 +1,45 @@
+"""Chart rendering. Functions are executed in process pool, so they take and return only plain data"""
+from io import BytesIO
+from typing import List
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+from matplotlib import pyplot as plt  # noqa: E402
+
+PIE = "pie"
+BAR = "bar"
+
+
+def _to_png(figure) -> bytes:
+    buffer = BytesIO()
+    figure.savefig(buffer, format="png", dpi=100, bbox_inches="tight")
+    plt.close(figure)
+    return buffer.getvalue()
+
+
+def render_pie_chart(title: str, labels: List[str], values: List[float]) -> bytes:
+    figure, ax = plt.subplots(figsize=(6, 6))
+    ax.pie(values, labels=labels, autopct="%1.1f%%", startangle=90)
+    ax.axis("equal")
+    ax.set_title(title)
+    return _to_png(figure)
+
+
+def render_bar_chart(title: str, labels: List[str], values: List[float]) -> bytes:
+    figure, ax = plt.subplots(figsize=(8, 4))
+    ax.bar(labels, values)
+    ax.set_title(title)
+    ax.tick_params(axis="x", labelrotation=45)
+    return _to_png(figure)
+
+
+renderers = {
+    PIE: render_pie_chart,
+    BAR: render_bar_chart,
+}
+
+
+def render_chart(kind: str, title: str, labels: List[str], values: List[float]) -> bytes:
+    return renderers[kind](title, labels, values)
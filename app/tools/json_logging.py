@@ -0,0 +1,127 @@
+"""Logging through queue, so slow disk or stdout never blocks event loop.
+
+Loggers put records into in-memory queue, QueueListener thread formats them as JSON lines and writes
+to handlers. update_id, chat_id and handler of update being processed are taken from context variables
+set by LoggingContextMiddleware. Records up to INFO of chatty loggers can be sampled before they reach
+the queue.
+"""
+import copy
+import datetime
+import logging
+import queue
+import random
+import sys
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional
+
+import ujson
+
+update_id_var = ContextVar("update_id", default=None)
+chat_id_var = ContextVar("chat_id", default=None)
+handler_var = ContextVar("handler", default=None)
+# outcome of update, middlewares that reject update set it before CancelHandler
+update_status_var = ContextVar("update_status", default=None)
+
+CONTEXT_FIELDS = ("update_id", "chat_id", "handler")
+EXTRA_FIELDS = ("duration_ms", "status")
+
+
+class ContextFilter(logging.Filter):
+    """Adds context of current update to record. Runs in thread of caller, where context is set"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.update_id = update_id_var.get()
+        record.chat_id = chat_id_var.get()
+        record.handler = handler_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps share of records up to max_level by logger name: {"aiogram": 0.1} keeps 10% of records of
+    aiogram and its children. The longest matching name wins, other loggers are not sampled"""
+
+    def __init__(self, rates: Dict[str, float], max_level: int = logging.INFO):
+        super().__init__()
+        self.rates = rates
+        self.max_level = max_level
+        self._logger_rates: Dict[str, float] = {}
+
+    def _rate(self, name: str) -> float:
+        if name not in self._logger_rates:
+            matching = [prefix for prefix in self.rates if name == prefix or name.startswith(prefix + ".")]
+            self._logger_rates[name] = self.rates[max(matching, key=len)] if matching else 1.0
+        return self._logger_rates[name]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS + EXTRA_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return ujson.dumps(entry, ensure_ascii=False)
+
+
+class _QueueHandler(QueueHandler):
+    """Message and traceback are rendered by caller because args and traceback may change later,
+    everything else is done by listener"""
+
+    _exception_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        return record
+
+
+def setup_logging(level: str, log_file: Optional[str] = None, sampling: Optional[Dict[str, float]] = None,
+                  stream=sys.stdout) -> QueueListener:
+    """JSON lines to stream and log_file through queue. Returns started listener, stop it on shutdown
+    to write remaining records"""
+    handlers = [logging.StreamHandler(stream)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(JsonFormatter())
+    return start_queue_logging(handlers, level=level, sampling=sampling)
+
+
+def start_queue_logging(handlers: List[logging.Handler], level: str,
+                        sampling: Optional[Dict[str, float]] = None) -> QueueListener:
+    """Replaces handlers of root logger with queue drained into handlers by listener thread"""
+    records = queue.SimpleQueue()
+    queue_handler = _QueueHandler(records)
+    if sampling:
+        queue_handler.addFilter(SamplingFilter(sampling))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(records, *handlers)
+    listener.start()
+    return listener
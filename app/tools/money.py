@@ -0,0 +1,37 @@
+"""Money amounts are stored as integer number of minor units (kopecks, cents). Scale is set per currency"""
+from decimal import Decimal, InvalidOperation
+
+DEFAULT_SCALE = 2
+# far below BIGINT and redis 64-bit counters, so sums of many amounts still fit
+MAX_MINOR_UNITS = 10 ** 12
+
+
+class AmountTooLarge(ValueError):
+    pass
+
+
+def parse_amount(text: str, scale: int = DEFAULT_SCALE) -> int:
+    """Converts user input like '100', '100.5' or '100,50' to minor units.
+    Raises ValueError if text is not a positive number with at most scale decimal places,
+    AmountTooLarge if amount is above MAX_MINOR_UNITS"""
+    try:
+        amount = Decimal(text.strip().replace(",", "."))
+    except InvalidOperation:
+        raise ValueError(f"Not a number: {text}")
+    if not amount.is_finite() or amount <= 0:
+        raise ValueError(f"Amount should be positive: {text}")
+    minor = amount.scaleb(scale)
+    if minor != minor.to_integral_value():
+        raise ValueError(f"Too many decimal places: {text}")
+    if minor > MAX_MINOR_UNITS:
+        raise AmountTooLarge(f"Amount is too large: {text}")
+    return int(minor)
+
+
+def format_amount(minor: int, scale: int = DEFAULT_SCALE) -> str:
+    """Converts minor units to string. Zero fraction is not shown: 10050 -> '100.5', 10000 -> '100'"""
+    amount = Decimal(int(minor)).scaleb(-scale)
+    text = f"{amount:f}"
+    if "." in text:
+        text = text.rstrip("0").rstrip(".")
+    return text
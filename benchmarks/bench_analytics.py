@@ -0,0 +1,54 @@
+"""Full spending analysis of a heavy user.
+
+Generates daily totals of a user with many categories for several years in the form returned by
+DbFunctions.get_daily_totals_by_category, then times building of the matrix and the analysis.
+
+    python -m benchmarks.bench_analytics --categories 30 --years 5
+"""
+import argparse
+import datetime
+import statistics
+import time
+
+import numpy as np
+
+from app.services.analytics import analyze, daily_matrix
+
+
+def _rows(categories: int, date_from: datetime.date, days: int, density: float):
+    rng = np.random.default_rng(0)
+    rows = []
+    for category in range(categories):
+        offsets = np.flatnonzero(rng.random(days) < density)
+        totals = rng.integers(100, 500_000, size=len(offsets))
+        rows.append((f"category{category}", "RUB", 2, offsets.tolist(), totals.tolist()))
+    return rows
+
+
+def bench(categories: int, years: int, density: float, runs: int):
+    date_to = datetime.date.today()
+    date_from = date_to - datetime.timedelta(days=365 * years)
+    rows = _rows(categories, date_from, (date_to - date_from).days + 1, density)
+
+    build, analysis = [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        spending = daily_matrix(rows, date_from, date_to)
+        build.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        analyze(spending)
+        analysis.append(time.perf_counter() - started)
+
+    print(f"{categories} categories x {spending.daily.shape[1]} days, "
+          f"{sum(len(row[3]) for row in rows)} non-empty days")
+    print(f"matrix: {statistics.median(build) * 1000:.2f} ms, analysis: {statistics.median(analysis) * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Spending analytics benchmark")
+    parser.add_argument("--categories", type=int, default=30)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--density", type=float, default=0.3, help="share of days with expenses in category")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    bench(categories=args.categories, years=args.years, density=args.density, runs=args.runs)
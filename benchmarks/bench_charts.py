@@ -0,0 +1,94 @@
+"""Cold and warm latency of ChartService.send_chart.
+
+Cold is rendering in process pool and upload of image with empty cache, warm is the same chart sent again
+by telegram file_id saved after upload. Bot is a stub which records what was sent and sleeps like Bot API:
+api latency for every request plus upload time of image bytes.
+Requires redis, REDIS_HOST/REDIS_PORT are read from environment.
+
+    python -m benchmarks.bench_charts --runs 20 --api-latency-ms 50 --upload-mbit 20
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+import aioredis
+from aiogram.types import InputFile
+from environs import Env
+
+from app.services.charts import ChartService
+from app.tools.charts import PIE
+from redis_repository.chart_repository import ChartRepository
+
+
+class StubBot:
+    """Records whether photo was uploaded or sent by file_id"""
+
+    def __init__(self, api_latency: float, upload_bytes_per_second: float):
+        self.api_latency = api_latency
+        self.upload_bytes_per_second = upload_bytes_per_second
+        self.sent = Counter()
+        self.uploaded_bytes = 0
+        self._file_ids = 0
+
+    async def send_photo(self, chat_id: int, photo):
+        delay = self.api_latency
+        if isinstance(photo, InputFile):
+            size = len(photo.file.getvalue())
+            self.sent["upload"] += 1
+            self.uploaded_bytes += size
+            delay += size / self.upload_bytes_per_second
+            self._file_ids += 1
+            file_id = f"file_{self._file_ids}"
+        else:
+            self.sent["file_id"] += 1
+            file_id = photo
+        await asyncio.sleep(delay)
+        return SimpleNamespace(photo=[SimpleNamespace(file_id=file_id)])
+
+
+def _chart_data(seed: int):
+    rnd = random.Random(seed)
+    labels = [f"category_{i}, рублей" for i in range(8)]
+    return labels, [rnd.randint(100, 10000) for _ in labels]
+
+
+async def bench(runs: int, workers: int, api_latency_ms: float, upload_mbit: float):
+    env = Env()
+    env.read_env()
+    redis = aioredis.Redis.from_url(f"redis://{env.str('REDIS_HOST', 'localhost')}:{env.str('REDIS_PORT', '6379')}")
+    executor = ProcessPoolExecutor(max_workers=workers)
+    service = ChartService(executor=executor, chart_repository=ChartRepository(redis=redis, ttl=60))
+    bot = StubBot(api_latency=api_latency_ms / 1000, upload_bytes_per_second=upload_mbit * 1_000_000 / 8)
+    # pool start is not a part of chart latency
+    await service.get_image("warmup", PIE, "warmup", *_chart_data(-1))
+
+    cold, warm = [], []
+    for run in range(runs):
+        labels, values = _chart_data(time.time_ns() + run)
+        for samples in (cold, warm):
+            started = time.perf_counter()
+            await service.send_chart(bot, chat_id=run, kind=PIE, title="bench", labels=labels, values=values)
+            samples.append(time.perf_counter() - started)
+
+    executor.shutdown()
+    await redis.close()
+    for name, samples in (("cold", cold), ("warm", warm)):
+        print(f"{name}: median {statistics.median(samples) * 1000:.2f} ms, max {max(samples) * 1000:.2f} ms")
+    print(f"sent by upload {bot.sent['upload']}, by file_id {bot.sent['file_id']}, "
+          f"uploaded {bot.uploaded_bytes / 1024:.0f} KiB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Chart latency benchmark")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--api-latency-ms", type=float, default=50, help="round trip of stub Bot API")
+    parser.add_argument("--upload-mbit", type=float, default=20, help="upload bandwidth to Bot API")
+    args = parser.parse_args()
+    asyncio.run(bench(runs=args.runs, workers=args.workers, api_latency_ms=args.api_latency_ms,
+                      upload_mbit=args.upload_mbit))
@@ -0,0 +1,78 @@
+"""Keyset pages of expenses history against OFFSET pages.
+
+Creates temporary table with expenses of one heavy user among others and the same index as
+expenses_user_created_id_idx, then times the first page and a deep page both ways.
+Requires PostgreSQL, connection is read from BOT_DB_* environment variables.
+
+    python -m benchmarks.bench_history_pages --rows 2000000 --page 5000
+"""
+import argparse
+import statistics
+import time
+
+import psycopg2
+from environs import Env
+
+SETUP = """
+CREATE TEMPORARY TABLE expenses_history AS
+SELECT id, CASE WHEN id %% 10 = 0 THEN (random() * 1000)::int ELSE 1 END AS user_id,
+       (CURRENT_DATE - (random() * 3650)::int) AS created_at, (random() * 100000)::bigint AS expenses_sum
+FROM generate_series(1, %(rows)s) AS id;
+CREATE INDEX ON expenses_history(user_id, created_at DESC, id DESC);
+ANALYZE expenses_history;
+"""
+
+KEYSET_QUERY = """
+SELECT id, created_at, expenses_sum FROM expenses_history
+WHERE user_id = 1 AND (created_at, id) < (%s, %s)
+ORDER BY created_at DESC, id DESC LIMIT %s;
+"""
+
+OFFSET_QUERY = """
+SELECT id, created_at, expenses_sum FROM expenses_history
+WHERE user_id = 1
+ORDER BY created_at DESC, id DESC LIMIT %s OFFSET %s;
+"""
+
+
+def _time_query(cur, query: str, args: tuple, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        cur.execute(query, args)
+        cur.fetchall()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def bench(rows: int, page: int, page_size: int, runs: int):
+    env = Env()
+    env.read_env()
+    conn = psycopg2.connect(database=env('BOT_DB_NAME', ''), user=env('BOT_DB_USER', ''),
+                            password=env('BOT_DB_PASSWORD', ''), host=env('BOT_DB_HOST', ''),
+                            port=env('BOT_DB_PORT', ''))
+    with conn.cursor() as cur:
+        cur.execute(SETUP, {"rows": rows})
+        for page_number in (1, page):
+            # cursor of the previous page is the last row shown on it
+            cur.execute(OFFSET_QUERY, (1, (page_number - 1) * page_size - 1 if page_number > 1 else 0))
+            cursor = cur.fetchone() if page_number > 1 else None
+            if page_number > 1 and cursor is None:
+                print(f"user has less than {page} pages, use more --rows")
+                break
+            created_at, expense_id = (cursor[1], cursor[0]) if cursor else ("infinity", 0)
+            keyset = _time_query(cur, KEYSET_QUERY, (created_at, expense_id, page_size), runs)
+            offset = _time_query(cur, OFFSET_QUERY, (page_size, (page_number - 1) * page_size), runs)
+            print(f"page {page_number}: keyset {keyset * 1000:.2f} ms, offset {offset * 1000:.2f} ms")
+    conn.rollback()
+    conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Keyset against OFFSET pagination benchmark")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--page", type=int, default=5000)
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    bench(rows=args.rows, page=args.page, page_size=args.page_size, runs=args.runs)
@@ -0,0 +1,111 @@
+"""Event loop lag with heavy logging: without logging, handler writing in event loop and queue logging.
+
+Every coroutine handles one simulated update per --pause-ms and logs two records for it like
+LoggingContextMiddleware does. The file handler stalls for --stall-ms every --stall-every records,
+like slow disk or full stdout pipe.
+
+    python -m benchmarks.bench_logging_lag --tasks 200 --pause-ms 20 --stall-ms 20 --stall-every 500
+"""
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from typing import List
+
+from app.tools.json_logging import ContextFilter, JsonFormatter, start_queue_logging, update_id_var
+
+MODES = ("none", "sync", "queue")
+
+
+class StallingFileHandler(logging.FileHandler):
+
+    def __init__(self, filename: str, stall: float, stall_every: int):
+        super().__init__(filename, encoding="utf-8")
+        self.stall = stall
+        self.stall_every = stall_every
+        self.records = 0
+
+    def emit(self, record: logging.LogRecord):
+        super().emit(record)
+        self.records += 1
+        if self.stall and self.records % self.stall_every == 0:
+            time.sleep(self.stall)
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))] if values else 0.0
+
+
+async def _update_loop(logger: logging.Logger, task: int, deadline: float, pause: float, counter: List[int]):
+    update_id = task * 1_000_000
+    while time.monotonic() < deadline:
+        update_id += 1
+        update_id_var.set(update_id)
+        logger.debug("Received update")
+        logger.info("Processed update", extra={"duration_ms": 0.1})
+        counter[0] += 1
+        await asyncio.sleep(pause)
+
+
+async def _measure_lag(lags: List[float], interval: float):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def _run(logger: logging.Logger, tasks: int, seconds: float, pause: float):
+    lags, counter = [], [0]
+    lag_task = asyncio.create_task(_measure_lag(lags, 0.005))
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(*(_update_loop(logger, task, deadline, pause, counter) for task in range(tasks)))
+    lag_task.cancel()
+    return lags, counter[0]
+
+
+def bench(mode: str, tasks: int, seconds: float, pause_ms: float, stall_ms: float, stall_every: int,
+          log_dir: str):
+    logger = logging.getLogger("bench")
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = StallingFileHandler(os.path.join(log_dir, f"{mode}.log"), stall_ms / 1000, stall_every)
+    handler.setFormatter(JsonFormatter())
+
+    listener = None
+    if mode == "sync":
+        handler.addFilter(ContextFilter())
+        root.addHandler(handler)
+        root.setLevel(logging.DEBUG)
+    elif mode == "queue":
+        listener = start_queue_logging([handler], level="DEBUG")
+    else:
+        root.setLevel(logging.CRITICAL)
+
+    lags, updates = asyncio.run(_run(logger, tasks, seconds, pause_ms / 1000))
+    started = time.perf_counter()
+    if listener:
+        listener.stop()
+    drain = time.perf_counter() - started
+    handler.close()
+    root.handlers.clear()
+
+    print(f"{mode:<6} {updates / seconds:>9.0f} updates/s, lag ms: " + ", ".join(
+        f"p{p} {_percentile(lags, p) * 1000:.2f}" for p in (50, 99, 100)) + f", queue drain {drain:.2f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Event loop lag with heavy logging")
+    parser.add_argument("--tasks", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--pause-ms", type=float, default=20, help="pause between updates of one task")
+    parser.add_argument("--stall-ms", type=float, default=20)
+    parser.add_argument("--stall-every", type=int, default=500)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as directory:
+        for bench_mode in MODES:
+            bench(bench_mode, tasks=args.tasks, seconds=args.seconds, pause_ms=args.pause_ms, stall_ms=args.stall_ms,
+                  stall_every=args.stall_every, log_dir=directory)
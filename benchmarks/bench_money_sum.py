@@ -0,0 +1,63 @@
+"""SUM over FLOAT amounts against SUM over BIGINT minor units.
+
+Creates two temporary tables with the same random amounts and times grouped sums like in reports.
+Requires PostgreSQL, connection is read from BOT_DB_* environment variables.
+
+    python -m benchmarks.bench_money_sum --rows 5000000
+"""
+import argparse
+import statistics
+import time
+
+import psycopg2
+from environs import Env
+
+SETUP = """
+CREATE TEMPORARY TABLE expenses_float AS
+SELECT (random() * 100)::int AS user_id, round((random() * 10000)::numeric, 2)::float AS expenses_sum
+FROM generate_series(1, %(rows)s);
+CREATE TEMPORARY TABLE expenses_minor AS
+SELECT user_id, round(expenses_sum * 100)::bigint AS expenses_sum FROM expenses_float;
+ANALYZE expenses_float;
+ANALYZE expenses_minor;
+"""
+
+
+def _time_query(cur, query: str, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        cur.execute(query)
+        cur.fetchall()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples)
+
+
+def bench(rows: int, runs: int):
+    env = Env()
+    env.read_env()
+    conn = psycopg2.connect(database=env('BOT_DB_NAME', ''), user=env('BOT_DB_USER', ''),
+                            password=env('BOT_DB_PASSWORD', ''), host=env('BOT_DB_HOST', ''),
+                            port=env('BOT_DB_PORT', ''))
+    with conn.cursor() as cur:
+        cur.execute(SETUP, {"rows": rows})
+        for table in ("expenses_float", "expenses_minor"):
+            total = _time_query(cur, f"SELECT SUM(expenses_sum) FROM {table};", runs)
+            grouped = _time_query(cur, f"SELECT user_id, SUM(expenses_sum) FROM {table} GROUP BY user_id;", runs)
+            print(f"{table}: SUM {total * 1000:.1f} ms, grouped SUM {grouped * 1000:.1f} ms")
+
+        cur.execute("SELECT SUM(expenses_sum) FROM expenses_float;")
+        float_sum = cur.fetchone()[0]
+        cur.execute("SELECT SUM(expenses_sum) FROM expenses_minor;")
+        minor_sum = cur.fetchone()[0]
+        print(f"float sum {float_sum!r}, minor units sum {minor_sum} (exact)")
+    conn.rollback()
+    conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="FLOAT against BIGINT SUM benchmark")
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    bench(rows=args.rows, runs=args.runs)
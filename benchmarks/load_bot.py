@@ -0,0 +1,361 @@
+"""End-to-end load test of the bot in one process.
+
+Real Dispatcher is built by init_bot/init_handlers with all middlewares and handlers, Bot API is replaced
+by FakeBot which answers every request locally. Simulated users go through authorization, open expenses
+insert, send expenses and return to menu. Updates of one user are processed one after another like
+Telegram delivers them, users run concurrently.
+
+Abusers authorize too and then flood expense messages until normal users finish, so report shows how many
+of them pass ThrottlingMiddleware and reach the database. Round trips are counted by in memory database.
+
+Requires redis, REDIS_HOST/REDIS_PORT are read from environment, use a separate redis instance because
+auth statuses and budget totals of simulated users are written there. Database is kept in memory by
+default, --db postgres uses BOT_DB_* settings and registers simulated users there.
+
+    python -m benchmarks.load_bot --users 2000 --expenses 5 --concurrency 500
+    python -m benchmarks.load_bot --users 200 --abusers 50 --throttling-rate 1 --throttling-burst 10
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from aiogram import Bot, types
+from aiogram.dispatcher import Dispatcher
+from environs import Env
+
+from app.conversation.dialogs.dialogs import buttons_names, confirmation_callbacks, msg
+from app.conversation.handlers.init_handlers import init_handlers
+from app.services.analytics import SpendingAnalytics
+from app.services.budget import BudgetTracker
+from app.services.charts import ChartService
+from app.services.dimensions import DimensionsCache
+from app.services.jobs import JobQueue
+from app.start_bot import init_bot
+from db.sharding import init_database
+from environment import init_environment
+from redis_repository.async_cache import AsyncCache
+from redis_repository.budget_repository import BudgetRepository
+from redis_repository.chart_repository import ChartRepository
+from redis_repository.jobs_repository import JobsRepository
+from redis_repository.redis import init_redis
+from redis_repository.redis_repository import RedisRepository
+from redis_repository.throttling_repository import ThrottlingRepository
+
+FAKE_TOKEN = "123456789:load-test-token"
+FIRST_TELEGRAM_ID = 1_900_000_000
+LOAD_TEST_EMAIL = "load{}@example.com"
+
+
+class FakeBot(Bot):
+    """Bot which answers Bot API requests locally after api_latency seconds"""
+
+    api_latency = 0.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = Counter()
+        self.texts = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        self.calls[method] += 1
+        data = data or {}
+        if "text" in data:
+            self.texts[data["text"]] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+        if method == "getMe":
+            # command filters ask for bot username when text has @ like email does
+            return {"id": 1, "is_bot": True, "first_name": "Load", "username": "load_test_bot"}
+        if not method.startswith(("send", "edit")):
+            return True
+
+        result = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(data.get("chat_id", 0)), "type": "private"},
+            "text": data.get("text", ""),
+        }
+        if method == "sendPhoto":
+            result["photo"] = [{"file_id": f"photo{result['message_id']}", "file_unique_id": "photo",
+                                "width": 800, "height": 600}]
+        return result
+
+
+class MemoryDb:
+    """In memory stand-in for DbFunctions with methods used by handlers. Every call sleeps db_latency
+    seconds in the event loop thread, like synchronous psycopg2 round trip does"""
+
+    def __init__(self, db_latency: float = 0.0):
+        self.db_latency = db_latency
+        self.users: Dict[int, int] = {}
+        self.emails: Dict[str, int] = {}
+        self.expenses: List[tuple] = []
+        self.budgets: Dict[tuple, int] = {}
+        self.round_trips = 0
+
+    def _round_trip(self):
+        self.round_trips += 1
+        if self.db_latency:
+            time.sleep(self.db_latency)
+
+    @property
+    def shards(self) -> List["MemoryDb"]:
+        return [self]
+
+    def for_user(self, telegram_id: int) -> "MemoryDb":
+        return self
+
+    def get_wait_time(self, max_age: float = 10.0) -> float:
+        return self.db_latency
+
+    def create_user(self, name: str, last_name: str, email: str, telegram_id: int):
+        self._round_trip()
+        self.users[telegram_id] = len(self.users) + 1
+        self.emails[email] = telegram_id
+
+    def find_user_by_email(self, email: str):
+        self._round_trip()
+        if email not in self.emails:
+            # the same error as fetchone()[0] of DbFunctions for unknown email
+            raise TypeError("'NoneType' object is not subscriptable")
+        return email
+
+    def get_user_id_by_telegram_id(self, telegram_id: int):
+        self._round_trip()
+        return self.users.get(telegram_id)
+
+    def get_currencies(self) -> List[tuple]:
+        self._round_trip()
+        return [(1, "RUB", 2), (2, "USD", 2)]
+
+    def get_categories(self) -> List[tuple]:
+        self._round_trip()
+        return [(1, "food"), (2, "transport")]
+
+    def insert_expense(self, spending_sum: int, currency_id: int, category_id: int, user_id: int):
+        self._round_trip()
+        self.expenses.append((spending_sum, currency_id, category_id, user_id))
+
+    def set_budget(self, user_id: int, category_id: int, limit_sum: int):
+        self._round_trip()
+        self.budgets[(user_id, category_id)] = limit_sum
+
+    def get_expenses_sum_by_category(self, user_id: int, date_from, date_to) -> List[tuple]:
+        self._round_trip()
+        return []
+
+    def get_expenses_sum_by_day(self, user_id: int, date_from, date_to) -> List[tuple]:
+        self._round_trip()
+        return []
+
+    def get_daily_totals_by_category(self, user_id: int, date_from, date_to) -> List[tuple]:
+        self._round_trip()
+        return []
+
+
+class LoadStats:
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors = Counter()
+        self.loop_lags: List[float] = []
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def _register_users(db, users: int):
+    for i in range(users):
+        telegram_id = FIRST_TELEGRAM_ID + i
+        user_db = db.for_user(telegram_id)
+        if user_db._db_execute_with_fetchone_row_return(
+                "SELECT id FROM expenses_bot_user WHERE telegram_id = %s;", telegram_id) is None:
+            user_db.create_user("Load", "Test", LOAD_TEST_EMAIL.format(i), telegram_id)
+
+
+class SimulatedUser:
+
+    def __init__(self, dp: Dispatcher, stats: LoadStats, update_ids, number: int, expense_text: str):
+        self.dp = dp
+        self.stats = stats
+        self.update_ids = update_ids
+        self.telegram_id = FIRST_TELEGRAM_ID + number
+        self.email = LOAD_TEST_EMAIL.format(number)
+        self.expense_text = expense_text
+        self._message_ids = itertools.count(1)
+
+    def _message(self, text: str) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": self.telegram_id, "type": "private"},
+            "from": {"id": self.telegram_id, "is_bot": False, "first_name": "Load"},
+            "text": text,
+        }
+
+    async def _feed(self, stage: str, update: dict):
+        update = types.Update(update_id=next(self.update_ids), **update)
+        started = time.perf_counter()
+        try:
+            # every update in its own task like polling does, context variables of aiogram filters and
+            # logging context are per update. process_updates runs update middlewares, process_update does not
+            await asyncio.create_task(self.dp.process_updates([update]))
+        except Exception:
+            self.stats.errors[stage] += 1
+        self.stats.latencies[stage].append(time.perf_counter() - started)
+
+    async def send_message(self, stage: str, text: str):
+        await self._feed(stage, {"message": self._message(text)})
+
+    async def press_button(self, stage: str, data: str):
+        await self._feed(stage, {"callback_query": {
+            "id": str(self.telegram_id),
+            "from": {"id": self.telegram_id, "is_bot": False, "first_name": "Load"},
+            "chat_instance": "load",
+            "data": data,
+            "message": self._message(""),
+        }})
+
+    async def _authorize(self):
+        await self.send_message("start", "/start")
+        await self.press_button("authorize", "authorize")
+        await self.send_message("email", self.email)
+        await self.press_button("email_confirm", confirmation_callbacks.email_confirm)
+        await self.send_message("expenses_menu", buttons_names.get_expenses_info)
+
+    async def run(self, expenses: int):
+        await self._authorize()
+        for _ in range(expenses):
+            await self.send_message("expense", self.expense_text)
+        await self.send_message("back_to_menu", buttons_names.back_to_menu)
+
+    async def flood(self, stop: asyncio.Event):
+        """Sends expense messages without pause until stop is set"""
+        await self._authorize()
+        while not stop.is_set():
+            await self.send_message("flood", self.expense_text)
+
+
+async def _measure_loop_lag(stats: LoadStats, interval: float):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        stats.loop_lags.append(time.perf_counter() - started - interval)
+
+
+def _report(stats: LoadStats, bot: FakeBot, db, seconds: float, abuser_ids: range):
+    updates = sum(len(latencies) for latencies in stats.latencies.values())
+    print(f"{updates} updates in {seconds:.2f}s: {updates / seconds:.0f} updates/s")
+    print(f"{'stage':<15}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for stage, latencies in stats.latencies.items():
+        print(f"{stage:<15}{len(latencies):>8}{stats.errors[stage]:>8}"
+              + "".join(f"{_percentile(latencies, p) * 1000:>10.2f}" for p in (50, 95, 99, 100)))
+    print("event loop lag ms: " + ", ".join(
+        f"p{p} {_percentile(stats.loop_lags, p) * 1000:.2f}" for p in (50, 95, 99, 100)))
+    print(f"bot api calls: {dict(bot.calls)}")
+    print(f"throttled: {bot.texts[msg.throttled]}, overloaded: {bot.texts[msg.overloaded]}")
+    if isinstance(db, MemoryDb):
+        print(f"db round trips: {db.round_trips}, {db.round_trips / seconds:.0f}/s")
+        abuser_expenses = sum(1 for *_, user_id in db.expenses if user_id in abuser_ids)
+        print(f"expenses inserted: normal users {len(db.expenses) - abuser_expenses}, "
+              f"abusers {abuser_expenses} of {len(stats.latencies['flood'])} flood messages")
+
+
+async def load(users: int, expenses: int, concurrency: int, abusers: int, db_kind: str, db_latency_ms: float,
+               api_latency_ms: float, throttling_rate: float, throttling_burst: int, lag_interval_ms: float):
+    os.environ.setdefault("TELEGRAM_TOKEN", FAKE_TOKEN)
+    os.environ.setdefault("LOGGING_LEVEL", "ERROR")
+    environment = init_environment()
+    env = Env()
+    env.read_env()
+
+    if db_kind == "postgres":
+        db = init_database(env)
+        _register_users(db, users + abusers)
+    else:
+        db = MemoryDb()
+        for i in range(users + abusers):
+            db.create_user("Load", "Test", LOAD_TEST_EMAIL.format(i), FIRST_TELEGRAM_ID + i)
+        db.db_latency = db_latency_ms / 1000
+        db.round_trips = 0
+
+    dimensions = DimensionsCache(db)
+    _, currency_name, _ = db.shards[0].get_currencies()[0]
+    _, category_name = db.shards[0].get_categories()[0]
+    expense_text = f"100 {currency_name} {category_name}"
+
+    bot, dp = init_bot(environment, bot_class=FakeBot)
+    bot.api_latency = api_latency_ms / 1000
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+
+    redis = await init_redis(environment=environment)
+    chart_executor = ProcessPoolExecutor(max_workers=1)
+    init_handlers(
+        dp=dp, db=db, env=environment, redis=RedisRepository(redis=redis),
+        budget_tracker=BudgetTracker(db=db, budget_repository=BudgetRepository(
+            redis=redis, totals_ttl=environment.budget_totals_ttl)),
+        chart_service=ChartService(executor=chart_executor, chart_repository=ChartRepository(
+            redis=redis, ttl=environment.chart_cache_ttl)),
+        throttling_repository=ThrottlingRepository(redis=redis, rate=throttling_rate, burst=throttling_burst),
+        dimensions=dimensions, cache=AsyncCache(redis=redis),
+        analytics=SpendingAnalytics(db=db, history_days=environment.analytics_history_days,
+                                    cache_ttl=environment.analytics_cache_ttl,
+                                    cache_size=environment.analytics_cache_size),
+        job_queue=JobQueue(jobs_repository=JobsRepository(redis=redis, prefix=environment.jobs_prefix),
+                           dedup_ttl=environment.jobs_dedup_ttl))
+
+    stats = LoadStats()
+    update_ids = itertools.count(1)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_user(number: int):
+        async with semaphore:
+            await SimulatedUser(dp, stats, update_ids, number, expense_text).run(expenses)
+
+    stop_flood = asyncio.Event()
+    lag_task = asyncio.create_task(_measure_loop_lag(stats, lag_interval_ms / 1000))
+    started = time.perf_counter()
+    flood_tasks = [asyncio.create_task(SimulatedUser(dp, stats, update_ids, number, expense_text).flood(stop_flood))
+                   for number in range(users, users + abusers)]
+    try:
+        await asyncio.gather(*(run_user(number) for number in range(users)))
+    finally:
+        stop_flood.set()
+        await asyncio.gather(*flood_tasks, return_exceptions=True)
+        seconds = time.perf_counter() - started
+        lag_task.cancel()
+        chart_executor.shutdown(wait=False)
+        await redis.close()
+    # memory database numbers users from 1 in order of creation
+    _report(stats, bot, db, seconds, abuser_ids=range(users + 1, users + abusers + 1))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="End-to-end load test of dispatcher, middlewares and handlers")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--expenses", type=int, default=5, help="expense messages per user")
+    parser.add_argument("--concurrency", type=int, default=200, help="users active at the same time")
+    parser.add_argument("--abusers", type=int, default=0, help="users flooding expense messages")
+    parser.add_argument("--db", choices=("memory", "postgres"), default="memory")
+    parser.add_argument("--db-latency-ms", type=float, default=0, help="round trip of in memory database")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="round trip of fake Bot API")
+    parser.add_argument("--throttling-rate", type=float, default=1000,
+                        help="high by default to measure handlers, set production values to test shedding")
+    parser.add_argument("--throttling-burst", type=int, default=1000)
+    parser.add_argument("--lag-interval-ms", type=float, default=10)
+    args = parser.parse_args()
+    asyncio.run(load(users=args.users, expenses=args.expenses, concurrency=args.concurrency, abusers=args.abusers,
+                     db_kind=args.db, db_latency_ms=args.db_latency_ms, api_latency_ms=args.api_latency_ms,
+                     throttling_rate=args.throttling_rate, throttling_burst=args.throttling_burst,
+                     lag_interval_ms=args.lag_interval_ms))
@@ -1,28 +1,64 @@
+import asyncio
 import datetime
 import logging
+import threading
+import time
 from contextlib import contextmanager
-from os import path
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Set, Tuple
 
 import psycopg2
 from psycopg2 import pool
+from psycopg2.extras import execute_values
+
+MAX_CONNECTIONS = 10
+WAIT_TIME_SMOOTHING = 0.2
+# only for calls from executor threads, calls from event loop thread don't wait for free connection
+POOL_ACQUIRE_TIMEOUT = 5.0
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+def _in_event_loop_thread() -> bool:
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
 
 
 class DbConnector:
 
     def __init__(self, db_connect_info: Dict[str, Any]):
 
-        self.conn_pool = pool.SimpleConnectionPool(minconn=1, maxconn=10, **db_connect_info)
+        self.db_connect_info = db_connect_info
+        self.conn_pool = pool.ThreadedConnectionPool(minconn=1, maxconn=MAX_CONNECTIONS, **db_connect_info)
+        # pool raises PoolError when all connections are taken, so callers wait for free connection here
+        self._conn_semaphore = threading.BoundedSemaphore(MAX_CONNECTIONS)
+        self.wait_time = 0.0
+        self.wait_time_updated_at = 0.0
 
-        log_file_path = path.join(path.dirname(path.abspath("__file__")), 'logging.ini')
-        logging.config.fileConfig(log_file_path, disable_existing_loggers=False)
         logger = logging.getLogger(__name__)
         logger.info("Start db instance")
 
+    def _acquire_connection_slot(self):
+        """Takes one of MAX_CONNECTIONS slots. Handlers call database from event loop thread, waiting there
+        would stop the whole bot, so there PoolExhausted is raised at once when all connections are taken.
+        Executor threads wait up to POOL_ACQUIRE_TIMEOUT"""
+        timeout = 0 if _in_event_loop_thread() else POOL_ACQUIRE_TIMEOUT
+        started = time.monotonic()
+        acquired = self._conn_semaphore.acquire(timeout=timeout)
+        # rejected caller counts as waiting the whole timeout, so throttling starts shedding load
+        self._update_wait_time(time.monotonic() - started if acquired else POOL_ACQUIRE_TIMEOUT)
+        if not acquired:
+            raise PoolExhausted(f"All {MAX_CONNECTIONS} database connections are taken")
+
     @contextmanager
     def _get_cursor(self):
         """Context manager for cursor. Used in _execute function"""
         cursor, conn = None, None
+        self._acquire_connection_slot()
         try:
             conn = self.conn_pool.getconn()
             cursor = conn.cursor()
@@ -32,6 +68,33 @@ class DbConnector:
         finally:
             cursor.close()
             self.conn_pool.putconn(conn)
+            self._conn_semaphore.release()
+
+    @contextmanager
+    def _get_transaction_cursor(self):
+        """Cursor in transaction. Commits on success, on error rolls back and raises, so caller can retry"""
+        self._acquire_connection_slot()
+        try:
+            conn = self.conn_pool.getconn()
+            try:
+                with conn, conn.cursor() as cursor:
+                    yield cursor
+            finally:
+                self.conn_pool.putconn(conn)
+        finally:
+            self._conn_semaphore.release()
+
+    def _update_wait_time(self, elapsed: float):
+        """Smoothed time callers wait for free database connection. Used by throttling middleware
+        for load shedding"""
+        self.wait_time += WAIT_TIME_SMOOTHING * (elapsed - self.wait_time)
+        self.wait_time_updated_at = time.monotonic()
+
+    def get_wait_time(self, max_age: float = 10.0) -> float:
+        """Smoothed wait time. Old value means there were no queries for a while, so database is not busy"""
+        if time.monotonic() - self.wait_time_updated_at > max_age:
+            return 0.0
+        return self.wait_time
 
     def _execute(self, query, *args):
         """Custom execute function with context manager. Used for INSERT, UPDATE, DELETE functions"""
@@ -39,6 +102,14 @@ class DbConnector:
             cur.execute(query, args)
             cur.execute("COMMIT")
 
+    def _execute_with_return(self, query, *args) -> Any:
+        """The same as _execute, but returns first value of result. Used for INSERT ... RETURNING"""
+        with self._get_cursor() as cur:
+            cur.execute(query, args)
+            result = cur.fetchone()[0]
+            cur.execute("COMMIT")
+            return result
+
 
 class BaseDbExtended(DbConnector):
 
@@ -54,6 +125,12 @@ class BaseDbExtended(DbConnector):
             cur.execute(query=query, vars=args)
             return cur.fetchone()[0]
 
+    def _db_execute_with_fetchone_row_return(self, query, *args) -> Optional[tuple]:
+        """For select one row from database. Returns None if there is no such row"""
+        with self._get_cursor() as cur:
+            cur.execute(query=query, vars=args)
+            return cur.fetchone()
+
 
 class DbCreator(DbConnector):
 
@@ -80,9 +157,11 @@ class DbCreator(DbConnector):
         self._execute(query=query)
 
     def create_currency_table(self):
-        """Creates table currency"""
+        """Creates table currency. Scale is number of minor units digits, 2 for kopecks and cents"""
         query = """
-        CREATE TABLE IF NOT EXISTS currency(id SERIAL PRIMARY KEY, currency_name VARCHAR(100));
+        CREATE TABLE IF NOT EXISTS currency(
+        id SERIAL PRIMARY KEY, currency_name VARCHAR(100), scale SMALLINT NOT NULL DEFAULT 2
+        );
         """
         self._execute(query=query)
 
@@ -102,15 +181,17 @@ class DbCreator(DbConnector):
         self._execute(query=query)
 
     def create_expenses_table(self):
-        """Creates table expenses"""
+        """Creates table expenses. expenses_sum is in minor units of currency.
+        ingest_key is set for expenses from redis stream, it makes repeated inserts of batch no-op"""
         query = """
         CREATE TABLE IF NOT EXISTS expenses(
         id SERIAL PRIMARY KEY,
-        expenses_sum FLOAT,
+        expenses_sum BIGINT,
         currency_id INTEGER NOT NULL,
         category_id INTEGER NOT NULL,
         user_id INTEGER NOT NULL,
         created_at DATE DEFAULT CURRENT_DATE,
+        ingest_key VARCHAR(64) UNIQUE,
         FOREIGN KEY (currency_id) REFERENCES currency(id) ON DELETE RESTRICT,
         FOREIGN KEY (category_id) REFERENCES expenses_category(id) ON DELETE RESTRICT,
         FOREIGN KEY (user_id) REFERENCES expenses_bot_user(id) ON DELETE RESTRICT
@@ -118,6 +199,32 @@ class DbCreator(DbConnector):
         """
         self._execute(query=query)
 
+    def create_budget_table(self):
+        """Creates table expenses_budget. Monthly spending limit per user and category in minor units"""
+        query = """
+        CREATE TABLE IF NOT EXISTS expenses_budget(
+        id SERIAL PRIMARY KEY,
+        limit_sum BIGINT NOT NULL,
+        category_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        UNIQUE (user_id, category_id),
+        FOREIGN KEY (category_id) REFERENCES expenses_category(id) ON DELETE RESTRICT,
+        FOREIGN KEY (user_id) REFERENCES expenses_bot_user(id) ON DELETE CASCADE
+        );
+        """
+        self._execute(query=query)
+
+    def create_expenses_indexes(self):
+        """Creates index for per user and category aggregations over period, used by budget reconciliation,
+        and index for pages of user expenses history"""
+        query = """
+        CREATE INDEX IF NOT EXISTS expenses_user_category_created_idx 
+        ON expenses(user_id, category_id, created_at);
+        CREATE INDEX IF NOT EXISTS expenses_user_created_id_idx
+        ON expenses(user_id, created_at DESC, id DESC);
+        """
+        self._execute(query=query)
+
     def create_first_weekday_func(self):
         """
         Function to get first day of week. For get_expenses_by_week and get_expenses_by_category_for_week functions
@@ -207,6 +314,8 @@ class DbCreator(DbConnector):
         self.create_table_category_dictionary()
         self.create_currency_table()
         self.create_expenses_table()
+        self.create_budget_table()
+        self.create_expenses_indexes()
         self.create_first_weekday_func()
         self.create_last_weekday_func()
         self.create_get_first_month_day_func()
@@ -221,10 +330,19 @@ class DbFunctions(BaseDbExtended):
         logger = logging.getLogger(__name__)
         logger.info("Start db_functions instance")
 
+    @property
+    def shards(self) -> List["DbFunctions"]:
+        """All databases with users data. See db.sharding.ShardedDbFunctions"""
+        return [self]
+
+    def for_user(self, telegram_id: int) -> "DbFunctions":
+        """Database with data of user. See db.sharding.ShardedDbFunctions"""
+        return self
+
     def create_user(self, name: str, last_name: str, email: str, telegram_id: int):
         """Inserts user entry into expenses_bot_user table"""
         query = """
-        INSERT INTO expenses_bot_user(name, last_name, email, telegram_id) VALUES (%s, %s, %s, %S)
+        INSERT INTO expenses_bot_user(name, last_name, email, telegram_id) VALUES (%s, %s, %s, %s)
         """
         self._execute(query, name, last_name, email, telegram_id)
 
@@ -245,12 +363,27 @@ class DbFunctions(BaseDbExtended):
         """
         return self._db_execute_with_fetchone_return(query, category_name)
 
-    def insert_category(self, category_name: str):
-        """Inserts category entry into expenses_category table"""
+    def insert_category(self, category_name: str, category_id: Optional[int] = None) -> int:
+        """Inserts category entry into expenses_category table. Returns id of category.
+        category_id is set for copies of category on other shards"""
+        if category_id is None:
+            query = """
+            INSERT INTO expenses_category(category_name) VALUES (%s) RETURNING id;
+            """
+            return self._execute_with_return(query, category_name)
+        query = """
+        INSERT INTO expenses_category(id, category_name) VALUES (%s, %s)
+        ON CONFLICT (id) DO UPDATE SET category_name = EXCLUDED.category_name;
+        """
+        self._execute(query, category_id, category_name)
+        return category_id
+
+    def get_categories(self) -> List[Tuple[Any, ...]]:
+        """All categories (id, category_name)"""
         query = """
-        INSERT INTO expenses_category(category_name) VALUES (%s);
+        SELECT id, category_name FROM expenses_category ORDER BY id;
         """
-        self._execute(query, category_name)
+        return self._db_execute_with_fetchall_return(query)
 
     def check_currency(self, currency_name: str):
         """Get currency id by currency_name"""
@@ -259,20 +392,198 @@ class DbFunctions(BaseDbExtended):
         """
         return self._db_execute_with_fetchone_return(query, currency_name)
 
-    def insert_currency(self, currency_name: str):
-        """Inserts currency entry into currency table"""
+    def get_currency(self, currency_name: str) -> Optional[Tuple[int, int]]:
+        """Get currency id and scale by currency_name. None if there is no such currency"""
         query = """
-        INSERT INTO currency(currency_name) VALUES (%s);
+        SELECT id, scale FROM currency WHERE currency_name = %s;
         """
-        self._execute(query, currency_name)
+        return self._db_execute_with_fetchone_row_return(query, currency_name)
+
+    def get_currencies(self) -> List[Tuple[Any, ...]]:
+        """All currencies (id, currency_name, scale)"""
+        query = """
+        SELECT id, currency_name, scale FROM currency ORDER BY id;
+        """
+        return self._db_execute_with_fetchall_return(query)
+
+    def insert_currency(self, currency_name: str, scale: int = 2, currency_id: Optional[int] = None) -> int:
+        """Inserts currency entry into currency table. Returns id of currency.
+        currency_id is set for copies of currency on other shards"""
+        if currency_id is None:
+            query = """
+            INSERT INTO currency(currency_name, scale) VALUES (%s, %s) RETURNING id;
+            """
+            return self._execute_with_return(query, currency_name, scale)
+        query = """
+        INSERT INTO currency(id, currency_name, scale) VALUES (%s, %s, %s)
+        ON CONFLICT (id) DO UPDATE SET currency_name = EXCLUDED.currency_name, scale = EXCLUDED.scale;
+        """
+        self._execute(query, currency_id, currency_name, scale)
+        return currency_id
 
     def insert_expense(self, spending_sum: int, currency_id: int, category_id: int, user_id: int):
-        """Insert expense into expenses table"""
+        """Insert expense into expenses table. spending_sum is in minor units of currency"""
         query = """
         INSERT INTO expenses(expenses_sum, currency_id, category_id, user_id) VALUES (%s, %s, %s, %s)
         """
         self._execute(query, spending_sum, currency_id, category_id, user_id)
 
+    def insert_expenses_batch(self, rows: List[Tuple[Any, ...]]) -> Set[str]:
+        """Inserts expenses in one statement. Rows are
+        (expenses_sum, currency_id, category_id, telegram_id, created_at, ingest_key).
+        Rows with ingest_key that is already in table are skipped, rows of users missing in database are not
+        inserted. Returns ingest keys of rows that are in table after insert"""
+        query = """
+        INSERT INTO expenses(expenses_sum, currency_id, category_id, user_id, created_at, ingest_key)
+        SELECT v.expenses_sum, v.currency_id, v.category_id, u.id, v.created_at, v.ingest_key
+        FROM (VALUES %s) AS v(expenses_sum, currency_id, category_id, telegram_id, created_at, ingest_key)
+        JOIN expenses_bot_user u ON u.telegram_id = v.telegram_id
+        ON CONFLICT (ingest_key) DO NOTHING;
+        """
+        ingest_keys = [row[5] for row in rows]
+        with self._get_transaction_cursor() as cur:
+            execute_values(cur, query, rows, template="(%s::bigint, %s::int, %s::int, %s::int, %s::date, %s)",
+                           page_size=len(rows) or 1)
+            cur.execute("SELECT ingest_key FROM expenses WHERE ingest_key = ANY(%s);", (ingest_keys,))
+            return {ingest_key for ingest_key, in cur.fetchall()}
+
+    def set_budget(self, user_id: int, category_id: int, limit_sum: int):
+        """Inserts or updates monthly budget for category. limit_sum is in minor units"""
+        query = """
+        INSERT INTO expenses_budget(limit_sum, category_id, user_id) VALUES (%s, %s, %s)
+        ON CONFLICT (user_id, category_id) DO UPDATE SET limit_sum = EXCLUDED.limit_sum;
+        """
+        self._execute(query, limit_sum, category_id, user_id)
+
+    def get_budget_totals_for_current_month(self) -> List[Tuple[Any, ...]]:
+        """Budget limit and spent sum for current month for every user budget by telegram_id.
+        Used for budgets reconciliation"""
+        query = """
+        SELECT u.telegram_id, b.category_id, b.limit_sum, COALESCE(SUM(exp.expenses_sum), 0)
+        FROM expenses_budget b
+        JOIN expenses_bot_user u ON b.user_id = u.id
+        LEFT JOIN expenses exp ON exp.user_id = b.user_id AND exp.category_id = b.category_id
+        AND exp.created_at BETWEEN first_monthday() AND last_monthday()
+        GROUP BY u.telegram_id, b.category_id, b.limit_sum;
+        """
+        return self._db_execute_with_fetchall_return(query)
+
+    def get_expenses_totals_for_all_users(self, date_from: datetime.date, date_to: datetime.date,
+                                          slots: int = 1, slot: int = 0) -> List[Tuple[Any, ...]]:
+        """Expenses sums in minor units by category and currency for every user in period in one query.
+        Users are split into slots by telegram_id, so digest jobs can query only part of users at once.
+        Rows are ordered by telegram_id"""
+        query = """
+        SELECT u.telegram_id, exp_cat.category_name, cur.currency_name, cur.scale, SUM(exp.expenses_sum)
+        FROM expenses exp
+        JOIN expenses_bot_user u ON exp.user_id = u.id
+        JOIN expenses_category exp_cat ON exp.category_id = exp_cat.id
+        JOIN currency cur ON exp.currency_id = cur.id
+        WHERE exp.created_at BETWEEN %s AND %s AND u.telegram_id %% %s = %s
+        GROUP BY u.telegram_id, exp_cat.category_name, cur.currency_name, cur.scale
+        ORDER BY u.telegram_id;
+        """
+        return self._db_execute_with_fetchall_return(query, date_from, date_to, slots, slot)
+
+    def get_expenses_sum_by_category(self, user_id: int, date_from: datetime.date,
+                                     date_to: datetime.date) -> List[Tuple[Any, ...]]:
+        """User expenses sums by category and currency for period. Sums are in major units"""
+        query = """
+        SELECT exp_cat.category_name, cur.currency_name, (SUM(exp.expenses_sum) / 10.0 ^ cur.scale)::float
+        FROM expenses exp
+        JOIN expenses_category exp_cat ON exp.category_id = exp_cat.id
+        JOIN currency cur ON exp.currency_id = cur.id
+        WHERE exp.user_id = %s AND exp.created_at BETWEEN %s AND %s
+        GROUP BY exp_cat.category_name, cur.currency_name, cur.scale
+        ORDER BY exp_cat.category_name;
+        """
+        return self._db_execute_with_fetchall_return(query, user_id, date_from, date_to)
+
+    def get_expenses_sum_by_day(self, user_id: int, date_from: datetime.date,
+                                date_to: datetime.date) -> List[Tuple[Any, ...]]:
+        """User expenses sums by day for period. Sums are in major units"""
+        query = """
+        SELECT exp.created_at, SUM(exp.expenses_sum / 10.0 ^ cur.scale)::float
+        FROM expenses exp
+        JOIN currency cur ON exp.currency_id = cur.id
+        WHERE exp.user_id = %s AND exp.created_at BETWEEN %s AND %s
+        GROUP BY exp.created_at
+        ORDER BY exp.created_at;
+        """
+        return self._db_execute_with_fetchall_return(query, user_id, date_from, date_to)
+
+    def get_expenses_sum_by_month(self, user_id: int, date_from: datetime.date,
+                                  date_to: datetime.date) -> List[Tuple[Any, ...]]:
+        """User expenses sums by month and currency for period. Sums are in major units"""
+        query = """
+        SELECT date_trunc('month', exp.created_at)::date, cur.currency_name,
+               (SUM(exp.expenses_sum) / 10.0 ^ cur.scale)::float
+        FROM expenses exp
+        JOIN currency cur ON exp.currency_id = cur.id
+        WHERE exp.user_id = %s AND exp.created_at BETWEEN %s AND %s
+        GROUP BY 1, cur.currency_name, cur.scale
+        ORDER BY 1, cur.currency_name;
+        """
+        return self._db_execute_with_fetchall_return(query, user_id, date_from, date_to)
+
+    def get_expenses_for_export(self, user_id: int) -> List[Tuple[Any, ...]]:
+        """All user expenses: created_at, category_name, currency_name, expenses_sum in minor units, scale"""
+        query = """
+        SELECT exp.created_at, exp_cat.category_name, cur.currency_name, exp.expenses_sum, cur.scale
+        FROM expenses exp
+        JOIN expenses_category exp_cat ON exp.category_id = exp_cat.id
+        JOIN currency cur ON exp.currency_id = cur.id
+        WHERE exp.user_id = %s
+        ORDER BY exp.created_at, exp.id;
+        """
+        return self._db_execute_with_fetchall_return(query, user_id)
+
+    def get_daily_totals_by_category(self, user_id: int, date_from: datetime.date,
+                                     date_to: datetime.date) -> List[Tuple[Any, ...]]:
+        """User daily totals in minor units, one row per category and currency: category_name, currency_name,
+        scale, array of days since date_from, array of totals"""
+        query = """
+        SELECT exp_cat.category_name, cur.currency_name, cur.scale,
+               array_agg(daily.created_at - %s::date ORDER BY daily.created_at),
+               array_agg(daily.total ORDER BY daily.created_at)
+        FROM (
+            SELECT category_id, currency_id, created_at, SUM(expenses_sum)::bigint AS total
+            FROM expenses
+            WHERE user_id = %s AND created_at BETWEEN %s AND %s
+            GROUP BY category_id, currency_id, created_at
+        ) daily
+        JOIN expenses_category exp_cat ON daily.category_id = exp_cat.id
+        JOIN currency cur ON daily.currency_id = cur.id
+        GROUP BY exp_cat.category_name, cur.currency_name, cur.scale
+        ORDER BY exp_cat.category_name;
+        """
+        return self._db_execute_with_fetchall_return(query, date_from, user_id, date_from, date_to)
+
+    def get_expenses_page(self, user_id: int, limit: int, cursor: Optional[Tuple[datetime.date, int]] = None,
+                          newer: bool = False) -> Tuple[List[Tuple[Any, ...]], bool]:
+        """Page of user expenses from newest to oldest: id, created_at, category_name, currency_name,
+        expenses_sum, scale. cursor is (created_at, id) of the last row of previous page, or of the first row
+        of next page with newer=True. Every page is one index seek however far it is.
+        Returns rows and if there are more rows in the same direction"""
+        if cursor is None:
+            condition, order = "", "DESC"
+        elif newer:
+            condition, order = "AND (exp.created_at, exp.id) > (%s, %s)", "ASC"
+        else:
+            condition, order = "AND (exp.created_at, exp.id) < (%s, %s)", "DESC"
+        query = f"""
+        SELECT exp.id, exp.created_at, exp_cat.category_name, cur.currency_name, exp.expenses_sum, cur.scale
+        FROM expenses exp
+        JOIN expenses_category exp_cat ON exp.category_id = exp_cat.id
+        JOIN currency cur ON exp.currency_id = cur.id
+        WHERE exp.user_id = %s {condition}
+        ORDER BY exp.created_at {order}, exp.id {order}
+        LIMIT %s;
+        """
+        rows = self._db_execute_with_fetchall_return(query, user_id, *(cursor or ()), limit + 1) or []
+        page = rows[:limit]
+        return (page[::-1] if newer else page), len(rows) > limit
+
     def get_expenses_by_specific_day(self, day: datetime.date):
         """Expenses by specific day. For example 2022-10-10. Format for day is 2022-10-10"""
         query: str = """
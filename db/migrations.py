@@ -0,0 +1,153 @@
+"""Migrations of existing databases. Every migration checks current schema and can be run again.
+
+Money columns from FLOAT to BIGINT minor units run without long locks: new column is added without default,
+existing rows are converted in small batches, each batch in its own transaction, and columns are swapped
+by renaming in one short transaction. Old float values are kept in expenses_sum_float column.
+Run it before the bot version with minor units starts: otherwise the bot writes minor units into old FLOAT
+column and backfill multiplies them by 10 ^ scale again.
+
+Unique index on expenses.ingest_key for redis stream ingestion and indexes for budget reconciliation and
+expenses history pages are built concurrently. Missing tables are created after migrations, so empty
+database gets the whole schema.
+
+Every shard of BOT_DB_SHARDS is migrated, or the only BOT_DB_* database when shards are not set.
+Migration stops at first failed statement. New shards get currencies and categories from db.rebalance.
+
+    python -m db.migrations --batch-size 10000
+"""
+import argparse
+import logging
+from typing import Any, Dict
+
+from environs import Env
+
+from db.db_functions import DbCreator
+from db.sharding import init_database
+
+
+class DbMigrator(DbCreator):
+
+    def __init__(self, db_connect_info: Dict[str, Any]):
+        super().__init__(db_connect_info)
+        self.logger = logging.getLogger(__name__)
+
+    def _column_type(self, table: str, column: str) -> str:
+        query = """
+        SELECT data_type FROM information_schema.columns WHERE table_name = %s AND column_name = %s;
+        """
+        with self._get_transaction_cursor() as cur:
+            cur.execute(query, (table, column))
+            row = cur.fetchone()
+            return row[0] if row else ""
+
+    def _table_exists(self, table: str) -> bool:
+        with self._get_transaction_cursor() as cur:
+            cur.execute("SELECT to_regclass(%s) IS NOT NULL;", (table,))
+            return cur.fetchone()[0]
+
+    def _execute_in_transaction(self, query, *args) -> int:
+        """Unlike _execute, error is not swallowed: transaction is rolled back and error is raised,
+        so migration stops at failed step. Returns number of affected rows"""
+        with self._get_transaction_cursor() as cur:
+            cur.execute(query, args)
+            return cur.rowcount
+
+    def _execute(self, query, *args):
+        """Tables of empty database are created by DbCreator methods, their errors stop migration too"""
+        self._execute_in_transaction(query, *args)
+
+    def _execute_autocommit(self, query):
+        """For statements that can't run inside of transaction block, like CREATE INDEX CONCURRENTLY"""
+        conn = self.conn_pool.getconn()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(query)
+        finally:
+            conn.autocommit = False
+            self.conn_pool.putconn(conn)
+
+    def add_currency_scale(self):
+        """Constant default does not rewrite table since PostgreSQL 11"""
+        self._execute_in_transaction("ALTER TABLE currency ADD COLUMN IF NOT EXISTS scale SMALLINT NOT NULL DEFAULT 2;")
+
+    def migrate_expenses_sum(self, batch_size: int):
+        if self._column_type("expenses", "expenses_sum") == "bigint":
+            self.logger.info("expenses.expenses_sum is already in minor units")
+            return
+
+        self._execute_in_transaction("ALTER TABLE expenses ADD COLUMN IF NOT EXISTS expenses_sum_minor BIGINT;")
+        backfill = """
+        UPDATE expenses exp SET expenses_sum_minor = round(exp.expenses_sum * 10 ^ cur.scale)
+        FROM currency cur
+        WHERE cur.id = exp.currency_id AND exp.id > %s AND exp.id <= %s AND exp.expenses_sum_minor IS NULL;
+        """
+        with self._get_transaction_cursor() as cur:
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM expenses;")
+            max_id = cur.fetchone()[0]
+
+        # primary key ranges, so every batch is index scan of batch_size rows
+        converted = 0
+        for last_id in range(0, max_id, batch_size):
+            converted += self._execute_in_transaction(backfill, last_id, last_id + batch_size)
+            self.logger.info(f"expenses converted: {converted}")
+
+        # rows inserted by running bot during backfill are converted under the lock
+        swap = """
+        LOCK TABLE expenses IN ACCESS EXCLUSIVE MODE;
+        UPDATE expenses exp SET expenses_sum_minor = round(exp.expenses_sum * 10 ^ cur.scale)
+        FROM currency cur
+        WHERE cur.id = exp.currency_id AND exp.id > %s;
+        ALTER TABLE expenses RENAME COLUMN expenses_sum TO expenses_sum_float;
+        ALTER TABLE expenses RENAME COLUMN expenses_sum_minor TO expenses_sum;
+        """
+        self._execute_in_transaction(swap, max_id)
+
+    def migrate_budget_limit(self):
+        """Budgets table is small, so it is converted in place"""
+        if self._column_type("expenses_budget", "limit_sum") != "double precision":
+            return
+        self._execute_in_transaction(
+            "ALTER TABLE expenses_budget ALTER COLUMN limit_sum TYPE BIGINT USING round(limit_sum * 100);")
+
+    def migrate_to_minor_units(self, batch_size: int = 10000):
+        self.add_currency_scale()
+        self.migrate_expenses_sum(batch_size)
+        self.migrate_budget_limit()
+
+    def add_expenses_ingest_key(self):
+        self._execute_in_transaction("ALTER TABLE expenses ADD COLUMN IF NOT EXISTS ingest_key VARCHAR(64);")
+        self._execute_autocommit(
+            "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS expenses_ingest_key_key ON expenses(ingest_key);")
+
+    def add_expenses_user_category_index(self):
+        self._execute_autocommit(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS expenses_user_category_created_idx "
+            "ON expenses(user_id, category_id, created_at);")
+
+    def add_expenses_history_index(self):
+        self._execute_autocommit(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS expenses_user_created_id_idx "
+            "ON expenses(user_id, created_at DESC, id DESC);")
+
+    def migrate(self, batch_size: int = 10000):
+        if self._table_exists("expenses"):
+            self.migrate_to_minor_units(batch_size)
+            self.add_expenses_ingest_key()
+            self.add_expenses_user_category_index()
+            self.add_expenses_history_index()
+        # indexes of existing expenses are built above, so here only missing tables are created
+        self.create_tables_and_functions()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Migrates existing database to current schema")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    env = Env()
+    env.read_env()
+    for index, shard in enumerate(init_database(env).shards):
+        logging.info(f"Migrating database {index}")
+        DbMigrator(shard.db_connect_info).migrate(batch_size=args.batch_size)
@@ -0,0 +1,90 @@
+"""Moves users to shards they belong to after shards list is changed.
+
+BOT_DB_SHARDS is the new list of shard DSNs, existing shards keep their positions and new ones are added
+to the end. Users are moved one by one: user data is copied into target shard in one transaction and then
+deleted from source shard. Copy replaces partial data of previous runs, so the tool can be restarted.
+Run it while bot is stopped, expenses inserted into source shard during move of user are lost.
+
+    python -m db.rebalance --dry-run
+"""
+import argparse
+import logging
+from collections import Counter
+
+from environs import Env
+from psycopg2.extras import execute_values
+
+from db.db_functions import DbFunctions
+from db.sharding import ShardedDbFunctions
+
+
+def move_user(source: DbFunctions, target: DbFunctions, telegram_id: int):
+    source_conn = source.conn_pool.getconn()
+    target_conn = target.conn_pool.getconn()
+    try:
+        with source_conn, source_conn.cursor() as cur:
+            cur.execute("SELECT id, name, last_name, email FROM expenses_bot_user WHERE telegram_id = %s;",
+                        (telegram_id,))
+            user_id, name, last_name, email = cur.fetchone()
+            cur.execute("SELECT expenses_sum, currency_id, category_id, created_at, ingest_key FROM expenses "
+                        "WHERE user_id = %s;", (user_id,))
+            expenses = cur.fetchall()
+            cur.execute("SELECT limit_sum, category_id FROM expenses_budget WHERE user_id = %s;", (user_id,))
+            budgets = cur.fetchall()
+
+        with target_conn, target_conn.cursor() as cur:
+            cur.execute("""
+            DELETE FROM expenses WHERE user_id IN (SELECT id FROM expenses_bot_user WHERE telegram_id = %(t)s);
+            DELETE FROM expenses_budget WHERE user_id IN (SELECT id FROM expenses_bot_user WHERE telegram_id = %(t)s);
+            DELETE FROM expenses_bot_user WHERE telegram_id = %(t)s;
+            """, {"t": telegram_id})
+            cur.execute("INSERT INTO expenses_bot_user(name, last_name, email, telegram_id) "
+                        "VALUES (%s, %s, %s, %s) RETURNING id;", (name, last_name, email, telegram_id))
+            new_user_id = cur.fetchone()[0]
+            execute_values(cur, "INSERT INTO expenses(expenses_sum, currency_id, category_id, created_at, ingest_key, "
+                                "user_id) VALUES %s;", [(*row, new_user_id) for row in expenses])
+            execute_values(cur, "INSERT INTO expenses_budget(limit_sum, category_id, user_id) VALUES %s;",
+                           [(*row, new_user_id) for row in budgets])
+
+        with source_conn, source_conn.cursor() as cur:
+            cur.execute("""
+            DELETE FROM expenses WHERE user_id = %(u)s;
+            DELETE FROM expenses_budget WHERE user_id = %(u)s;
+            DELETE FROM expenses_bot_user WHERE id = %(u)s;
+            """, {"u": user_id})
+    finally:
+        source.conn_pool.putconn(source_conn)
+        target.conn_pool.putconn(target_conn)
+
+
+def rebalance(db: ShardedDbFunctions, dry_run: bool = False) -> Counter:
+    logger = logging.getLogger(__name__)
+    if not dry_run:
+        db.replicate_dimension_tables()
+
+    moved = Counter()
+    for index, shard in enumerate(db.shards):
+        telegram_ids = [row[0] for row in shard._db_execute_with_fetchall_return(
+            "SELECT telegram_id FROM expenses_bot_user;")]
+        for telegram_id in telegram_ids:
+            target = db.shard_index(telegram_id)
+            if target == index:
+                continue
+            moved[(index, target)] += 1
+            if not dry_run:
+                move_user(shard, db.shards[target], telegram_id)
+        logger.info(f"Shard {index}: {sum(v for k, v in moved.items() if k[0] == index)} users to move")
+    return moved
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Moves users between shards")
+    parser.add_argument("--dry-run", action="store_true", help="only count users to move")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    env = Env()
+    env.read_env()
+    sharded_db = ShardedDbFunctions([{"dsn": dsn} for dsn in env.list("BOT_DB_SHARDS")])
+    for (source_index, target_index), count in sorted(rebalance(sharded_db, dry_run=args.dry_run).items()):
+        print(f"shard {source_index} -> shard {target_index}: {count} users")
@@ -1,10 +1,13 @@
-import logging.config
 import logging
-from os import path
+from logging.handlers import QueueListener
 
 import environs
 from environs import Env
 
+from app.tools.json_logging import setup_logging
+
+DEFAULT_LOG_FILE = 'expenses_bot_logs.log'
+
 
 class Environment:
 
@@ -14,6 +17,44 @@ class Environment:
         self.redis_port = _env.str('REDIS_PORT', '6379')
         self.re_for_date_text_parse = _env('RE_FOR_DATE_LETTERS', '')
         self.logging_level = _env.str("LOGGING_LEVEL")
+        self.budget_reconcile_interval = _env.int('BUDGET_RECONCILE_INTERVAL', 600)
+        self.budget_totals_ttl = _env.int('BUDGET_TOTALS_TTL', 62 * 24 * 3600)
+        self.digest_enabled = _env.bool('DIGEST_ENABLED', True)
+        self.digest_dry_run = _env.bool('DIGEST_DRY_RUN', False)
+        self.digest_slots = _env.int('DIGEST_SLOTS', 12)
+        self.digest_start_hour = _env.int('DIGEST_START_HOUR', 9)
+        self.digest_window_minutes = _env.int('DIGEST_WINDOW_MINUTES', 180)
+        self.digest_messages_per_second = _env.float('DIGEST_MESSAGES_PER_SECOND', 25, validate=lambda n: n > 0)
+        self.throttling_rate = _env.float('THROTTLING_RATE', 1)
+        self.throttling_burst = _env.int('THROTTLING_BURST', 10)
+        self.throttling_db_wait_threshold = _env.float('THROTTLING_DB_WAIT_THRESHOLD', 0.5)
+        self.throttling_heavy_cost = _env.int('THROTTLING_HEAVY_COST', 3)
+        self.expenses_write_behind = _env.bool('EXPENSES_WRITE_BEHIND', False)
+        self.expenses_stream = _env.str('EXPENSES_STREAM', 'expenses:stream')
+        self.expenses_stream_group = _env.str('EXPENSES_STREAM_GROUP', 'expenses_flusher')
+        self.expenses_stream_batch_size = _env.int('EXPENSES_STREAM_BATCH_SIZE', 500)
+        self.expenses_stream_flush_interval_ms = _env.int('EXPENSES_STREAM_FLUSH_INTERVAL_MS', 1000)
+        self.expenses_stream_flusher_in_bot = _env.bool('EXPENSES_STREAM_FLUSHER_IN_BOT', True)
+        self.expenses_stream_max_attempts = _env.int('EXPENSES_STREAM_MAX_ATTEMPTS', 5)
+        self.expenses_stream_dead_letter = _env.str('EXPENSES_STREAM_DEAD_LETTER', 'expenses:stream:dead')
+        self.cache_serializer = _env.str('CACHE_SERIALIZER', 'orjson')
+        self.cache_compress_threshold = _env.int('CACHE_COMPRESS_THRESHOLD', 1024)
+        self.cache_stats_interval = _env.int('CACHE_STATS_INTERVAL', 300)
+        self.report_cache_ttl = _env.int('REPORT_CACHE_TTL', 60)
+        self.analytics_history_days = _env.int('ANALYTICS_HISTORY_DAYS', 2 * 366)
+        self.analytics_cache_ttl = _env.int('ANALYTICS_CACHE_TTL', 300)
+        self.analytics_cache_size = _env.int('ANALYTICS_CACHE_SIZE', 1000)
+        self.analytics_top_categories = _env.int('ANALYTICS_TOP_CATEGORIES', 5)
+        self.jobs_prefix = _env.str('JOBS_PREFIX', 'jobs')
+        self.jobs_timeout = _env.float('JOBS_TIMEOUT', 120)
+        self.jobs_dedup_ttl = _env.int('JOBS_DEDUP_TTL', 900)
+        self.jobs_concurrency = _env.int('JOBS_CONCURRENCY', 4)
+        self.jobs_max_attempts = _env.int('JOBS_MAX_ATTEMPTS', 2)
+        self.jobs_poll_interval_ms = _env.int('JOBS_POLL_INTERVAL_MS', 200)
+        self.jobs_metrics_interval = _env.int('JOBS_METRICS_INTERVAL', 60)
+        self.history_page_size = _env.int('HISTORY_PAGE_SIZE', 10)
+        self.chart_workers = _env.int('CHART_WORKERS', 2)
+        self.chart_cache_ttl = _env.int('CHART_CACHE_TTL', 7 * 24 * 3600)
 
     @property
     def redis_uri(self) -> str:
@@ -21,11 +62,17 @@ class Environment:
 
     @staticmethod
     def get_env_logger():
-        log_file_path = path.join(path.dirname(path.abspath("__file__")), 'logging.ini')
-        logging.config.fileConfig(log_file_path, disable_existing_loggers=False)
-        logger = logging.getLogger(__name__)
-        logger.setLevel(logging.INFO)
-        return logger
+        return logging.getLogger(__name__)
+
+
+def init_logging(with_file: bool = True) -> QueueListener:
+    """Sets up logging from raw LOGGING_LEVEL, LOG_FILE and LOG_SAMPLING before Environment is loaded,
+    so records logged while loading it are JSON too. Returns listener, stop it on shutdown"""
+    env = Env()
+    env.read_env()
+    sampling = {name: float(rate) for name, rate in env.dict('LOG_SAMPLING', {}).items()}
+    return setup_logging(level=env.str('LOGGING_LEVEL', 'INFO'),
+                         log_file=env.str('LOG_FILE', DEFAULT_LOG_FILE) if with_file else None, sampling=sampling)
 
 
 def init_environment() -> Environment:
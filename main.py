@@ -1,49 +1,99 @@
-import logging.config
+import asyncio
 import logging
-from os import path
+from concurrent.futures import ProcessPoolExecutor
 
 from aiogram.utils.executor import Executor
 from environs import Env
 
 from app.conversation.handlers.init_handlers import init_handlers
+from app.services.analytics import SpendingAnalytics
+from app.services.budget import BudgetTracker
+from app.services.charts import ChartService
+from app.services.digest import SENT_TTL, DigestScheduler
+from app.services.dimensions import DimensionsCache
+from app.services.expenses_stream import ExpensesFlusher, ExpensesStream
+from app.services.jobs import JobQueue
 from app.start_bot import init_bot, start_bot
-from db.db_functions import DbFunctions
-from environment import init_environment
+from db.sharding import init_database
+from environment import init_environment, init_logging
+from redis_repository.async_cache import AsyncCache, get_serializer
+from redis_repository.budget_repository import BudgetRepository
+from redis_repository.chart_repository import ChartRepository
+from redis_repository.digest_repository import DigestRepository
+from redis_repository.expenses_stream_repository import ExpensesStreamRepository
+from redis_repository.jobs_repository import JobsRepository
 from redis_repository.redis import init_redis
 from redis_repository.redis_repository import RedisRepository
+from redis_repository.throttling_repository import ThrottlingRepository
 
 
 def start_app():
-
-    log_file_path = path.join(path.dirname(path.abspath("__file__")), 'logging.ini')
-    logging.config.fileConfig(log_file_path, disable_existing_loggers=False)
+    log_listener = init_logging()
+    environment = init_environment()
     logger = logging.getLogger(__name__)
-    logger.setLevel(logging.INFO)
     logger.info("Starting app")
 
-    environment = init_environment()
     bot, dispatcher = init_bot(environment)
     executor = Executor(dispatcher)
 
     env = Env()
     env.read_env()
 
-    db_connect_info = {
-        "database": env('BOT_DB_NAME', ''),
-        "user": env('BOT_DB_USER', ''),
-        "password": env('BOT_DB_PASSWORD', ''),
-        "host": env('BOT_DB_HOST', ''),
-        "port": env('BOT_DB_PORT', '')
-    }
+    background_tasks = []
+    chart_executor = ProcessPoolExecutor(max_workers=environment.chart_workers)
 
     async def on_startup(*_, **__):
-        db = DbFunctions(db_connect_info)
+        db = init_database(env)
         redis = await init_redis(environment=environment)
         redis_repository = RedisRepository(redis=redis)
-        init_handlers(dp=dispatcher, db=db, redis=redis_repository, env=environment)
+        chart_service = ChartService(
+            executor=chart_executor, chart_repository=ChartRepository(redis=redis, ttl=environment.chart_cache_ttl))
+        throttling_repository = ThrottlingRepository(
+            redis=redis, rate=environment.throttling_rate, burst=environment.throttling_burst)
+        expenses_stream, stream_repository = None, None
+        if environment.expenses_write_behind:
+            stream_repository = ExpensesStreamRepository(
+                redis=redis, stream=environment.expenses_stream, group=environment.expenses_stream_group,
+                dead_letter_stream=environment.expenses_stream_dead_letter)
+        # reconciliation counts expenses waiting in stream, they are not in database yet
+        budget_tracker = BudgetTracker(
+            db=db, budget_repository=BudgetRepository(redis=redis, totals_ttl=environment.budget_totals_ttl),
+            stream_repository=stream_repository)
+        if stream_repository is not None:
+            expenses_stream = ExpensesStream(redis=redis, stream_repository=stream_repository,
+                                             budget_tracker=budget_tracker)
+            if environment.expenses_stream_flusher_in_bot:
+                flusher = ExpensesFlusher(db=db, stream_repository=stream_repository,
+                                          batch_size=environment.expenses_stream_batch_size,
+                                          flush_interval_ms=environment.expenses_stream_flush_interval_ms,
+                                          max_attempts=environment.expenses_stream_max_attempts)
+                background_tasks.append(asyncio.create_task(flusher.run()))
+        cache = AsyncCache(redis=redis, serializer=get_serializer(environment.cache_serializer),
+                           compress_threshold=environment.cache_compress_threshold)
+        background_tasks.append(asyncio.create_task(cache.run_stats_logging(environment.cache_stats_interval)))
+        init_handlers(dp=dispatcher, db=db, redis=redis_repository, env=environment, budget_tracker=budget_tracker,
+                      chart_service=chart_service, throttling_repository=throttling_repository,
+                      dimensions=DimensionsCache(db), cache=cache, expenses_stream=expenses_stream,
+                      analytics=SpendingAnalytics(db=db, history_days=environment.analytics_history_days,
+                                                  cache_ttl=environment.analytics_cache_ttl,
+                                                  cache_size=environment.analytics_cache_size),
+                      job_queue=JobQueue(jobs_repository=JobsRepository(redis=redis, prefix=environment.jobs_prefix),
+                                         dedup_ttl=environment.jobs_dedup_ttl))
+        background_tasks.append(
+            asyncio.create_task(budget_tracker.run_reconciliation(environment.budget_reconcile_interval)))
+        if environment.digest_enabled:
+            digest_scheduler = DigestScheduler(
+                bot=bot, db=db, digest_repository=DigestRepository(redis=redis, ttl=SENT_TTL),
+                slots=environment.digest_slots, start_hour=environment.digest_start_hour,
+                window_minutes=environment.digest_window_minutes,
+                messages_per_second=environment.digest_messages_per_second, dry_run=environment.digest_dry_run)
+            background_tasks.append(asyncio.create_task(digest_scheduler.run()))
 
     async def on_shutdown(*_, **__):
-        pass
+        for task in background_tasks:
+            task.cancel()
+        chart_executor.shutdown(wait=False)
+        log_listener.stop()
 
     executor.on_startup(on_startup)
     executor.on_shutdown(on_shutdown)
@@ -13,10 +13,6 @@ class AuthenticationMiddleware(BaseMiddleware):
         self.redis_repository = redis_repository
         self.logger = logging.getLogger(__name__)
 
-    async def on_process_message(self, message: types.Message, *_, **__):
-        is_active = await self.get_auth_user_status(message)
-        setattr(message, "authorize", is_active)
-
     async def on_pre_process_message(self, message: types.Message, *_, **__):
         is_active = await self.get_auth_user_status(message)
         setattr(message, "authorize", is_active)
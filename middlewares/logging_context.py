@@ -0,0 +1,85 @@
+import logging
+import time
+
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from app.tools.json_logging import chat_id_var, handler_var, update_id_var, update_status_var
+
+CANCELLED = "cancelled"
+
+
+class LoggingContextMiddleware(BaseMiddleware):
+    """Sets update_id, chat_id and handler for all records logged while update is processed.
+    Logs one record per update with processing time and status, instead of aiogram LoggingMiddleware.
+    Status is handled, unhandled when no handler matched, error, cancelled by later middleware,
+    or set by middleware that rejected update, like throttled and shed of ThrottlingMiddleware.
+    Must be the first middleware"""
+
+    def __init__(self):
+        super().__init__()
+        self.logger = logging.getLogger(__name__)
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        data["log_started"] = time.perf_counter()
+        update_id_var.set(update.update_id)
+        handler_var.set(None)
+        update_status_var.set(None)
+        if update.message:
+            chat_id_var.set(update.message.chat.id)
+        elif update.callback_query and update.callback_query.message:
+            chat_id_var.set(update.callback_query.message.chat.id)
+        else:
+            chat_id_var.set(None)
+        self.logger.debug("Received update")
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        duration_ms = round((time.perf_counter() - data["log_started"]) * 1000, 3)
+        status = update_status_var.get() or ("handled" if handler_var.get() else "unhandled")
+        self.logger.info("Processed update", extra={"duration_ms": duration_ms, "status": status})
+
+    async def on_pre_process_error(self, update: types.Update, error: Exception, data: dict):
+        update_status_var.set("error")
+
+    @staticmethod
+    def _start_pre_process():
+        # stays if later middleware raises CancelHandler, then post process of message is not called
+        update_status_var.set(CANCELLED)
+
+    @staticmethod
+    def _finish_pre_process():
+        # post process without handler means no handler matched
+        if update_status_var.get() == CANCELLED:
+            update_status_var.set(None)
+
+    def _start_handler(self, data: dict):
+        update_status_var.set(None)
+        handler = current_handler.get()
+        handler_var.set(getattr(handler, "__name__", None))
+        data["log_handler_started"] = time.perf_counter()
+
+    def _finish_handler(self, data: dict):
+        if "log_handler_started" in data:
+            duration_ms = round((time.perf_counter() - data["log_handler_started"]) * 1000, 3)
+            self.logger.debug("Handled", extra={"duration_ms": duration_ms})
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        self._start_pre_process()
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self._start_handler(data)
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        self._finish_pre_process()
+        self._finish_handler(data)
+
+    async def on_pre_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        self._start_pre_process()
+
+    async def on_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        self._start_handler(data)
+
+    async def on_post_process_callback_query(self, callback_query: types.CallbackQuery, results, data: dict):
+        self._finish_pre_process()
+        self._finish_handler(data)
@@ -0,0 +1,93 @@
+import logging
+from typing import Optional
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler, current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from app.conversation.dialogs.dialogs import msg
+from app.tools.json_logging import update_status_var
+from db.db_functions import PoolExhausted
+from db.sharding import Database
+from redis_repository.throttling_repository import ThrottlingRepository
+
+
+def throttling_cost(cost: int):
+    """Sets weight of handler for throttling middleware. Handlers without it cost 1"""
+
+    def decorator(func):
+        setattr(func, "throttling_cost", cost)
+        return func
+    return decorator
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Anti-flood for messages and callback queries.
+
+    Every update is charged 1 before other middlewares, so flood does not reach AuthenticationMiddleware.
+    When handler is known its additional cost is charged. Heavy handlers are rejected for everybody
+    while wait time for database connection is above threshold. Handlers that find no free connection
+    are rejected by on_pool_exhausted, registered as errors handler.
+    """
+
+    def __init__(self, throttling_repository: ThrottlingRepository, db: Database, db_wait_threshold: float,
+                 heavy_cost: int):
+        super().__init__()
+        self.throttling_repository = throttling_repository
+        self.db = db
+        self.db_wait_threshold = db_wait_threshold
+        self.heavy_cost = heavy_cost
+        self.logger = logging.getLogger(__name__)
+
+    async def on_pre_process_message(self, message: types.Message, *_, **__):
+        await self._throttle(message.from_user, message.chat.id, cost=1)
+
+    async def on_pre_process_callback_query(self, callback_query: types.CallbackQuery, *_, **__):
+        await self._throttle(callback_query.from_user, callback_query.from_user.id, cost=1)
+
+    async def on_process_message(self, message: types.Message, *_, **__):
+        await self._throttle_handler(message.from_user, message.chat.id)
+
+    async def on_process_callback_query(self, callback_query: types.CallbackQuery, *_, **__):
+        await self._throttle_handler(callback_query.from_user, callback_query.from_user.id)
+
+    async def _throttle_handler(self, user: Optional[types.User], chat_id: int):
+        handler = current_handler.get()
+        cost = getattr(handler, "throttling_cost", 1)
+        if cost >= self.heavy_cost and self.db.get_wait_time() > self.db_wait_threshold:
+            self.logger.warning(f"Load shedding: {handler.__name__} rejected for {chat_id}")
+            update_status_var.set("shed")
+            await self._reply(chat_id, msg.overloaded)
+            raise CancelHandler()
+        if cost > 1:
+            await self._throttle(user, chat_id, cost=cost - 1)
+
+    async def on_pool_exhausted(self, update: types.Update, error: PoolExhausted) -> bool:
+        if update.message:
+            chat_id = update.message.chat.id
+        elif update.callback_query:
+            chat_id = update.callback_query.from_user.id
+        else:
+            return True
+        self.logger.warning(f"Load shedding: {error}, update {update.update_id} of {chat_id} rejected")
+        update_status_var.set("shed")
+        await self._reply(chat_id, msg.overloaded)
+        return True
+
+    async def _throttle(self, user: Optional[types.User], chat_id: int, cost: int):
+        if user is None:
+            return
+        allowed, retry_after, notify = await self.throttling_repository.acquire(user.id, cost=cost)
+        if allowed:
+            return
+        update_status_var.set("throttled")
+        if notify:
+            await self._reply(chat_id, msg.throttled)
+        raise CancelHandler()
+
+    async def _reply(self, chat_id: int, text: str):
+        bot = self.manager.dispatcher.bot
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+        except Exception as err:
+            self.logger.warning(err)
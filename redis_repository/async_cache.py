@@ -0,0 +1,234 @@
+"""Async cache on aioredis pool of the bot.
+
+Values are serialized by pluggable serializer and compressed with zlib when they are larger than threshold.
+get_or_compute runs computation once for concurrent misses of the same key: in process by shared task,
+between processes by redis lock, other callers wait for value to appear in cache.
+"""
+import asyncio
+import logging
+import time
+import uuid
+import zlib
+from dataclasses import dataclass
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import ujson
+from aioredis import Redis
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+RAW = b"\x00"
+COMPRESSED = b"\x01"
+MISSING = object()
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class JsonSerializer:
+
+    @staticmethod
+    def dumps(value: Any) -> bytes:
+        return ujson.dumps(value, ensure_ascii=False).encode("utf-8")
+
+    @staticmethod
+    def loads(data: bytes) -> Any:
+        return ujson.loads(data)
+
+
+class OrjsonSerializer:
+
+    @staticmethod
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(value)
+
+    @staticmethod
+    def loads(data: bytes) -> Any:
+        return orjson.loads(data)
+
+
+class MsgpackSerializer:
+
+    @staticmethod
+    def dumps(value: Any) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+    @staticmethod
+    def loads(data: bytes) -> Any:
+        return msgpack.unpackb(data, raw=False)
+
+
+def get_serializer(name: str):
+    """Serializer by name: json, orjson or msgpack. Falls back to json if library is not installed"""
+    if name == "orjson" and orjson is not None:
+        return OrjsonSerializer()
+    if name == "msgpack" and msgpack is not None:
+        return MsgpackSerializer()
+    if name not in ("json", "orjson", "msgpack"):
+        raise ValueError(f"Unknown cache serializer: {name}")
+    return JsonSerializer()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    computes: int = 0
+    requests_seconds: float = 0.0
+    compute_seconds: float = 0.0
+
+    @property
+    def hit_ratio(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hit_ratio, 3),
+            "computes": self.computes,
+            "get_latency_ms": round(self.requests_seconds / requests * 1000, 3) if requests else 0.0,
+            "compute_latency_ms": round(self.compute_seconds / self.computes * 1000, 3) if self.computes else 0.0,
+        }
+
+
+class AsyncCache:
+
+    def __init__(self, redis: Redis, serializer=None, compress_threshold: int = 1024, namespace: str = "cache",
+                 lock_timeout: float = 10.0):
+        self.redis = redis
+        self.serializer = serializer or JsonSerializer()
+        self.compress_threshold = compress_threshold
+        self.namespace = namespace
+        self.lock_timeout = lock_timeout
+        self.stats = CacheStats()
+        self._computing: Dict[str, asyncio.Task] = {}
+        self._release_lock = redis.register_script(RELEASE_LOCK_SCRIPT)
+        self.logger = logging.getLogger(__name__)
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _encode(self, value: Any) -> bytes:
+        data = self.serializer.dumps(value)
+        if len(data) > self.compress_threshold:
+            return COMPRESSED + zlib.compress(data)
+        return RAW + data
+
+    def _decode(self, data: Optional[bytes]) -> Any:
+        if data is None:
+            return MISSING
+        if data[:1] == COMPRESSED:
+            return self.serializer.loads(zlib.decompress(data[1:]))
+        return self.serializer.loads(data[1:])
+
+    def _count(self, values: List[Any], started: float):
+        self.stats.requests_seconds += time.perf_counter() - started
+        for value in values:
+            if value is MISSING:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+
+    async def get(self, key: str, default: Any = None) -> Any:
+        started = time.perf_counter()
+        value = self._decode(await self.redis.get(self._key(key)))
+        self._count([value], started)
+        return default if value is MISSING else value
+
+    async def set(self, key: str, value: Any, ex: int):
+        await self.redis.set(self._key(key), self._encode(value), ex=ex)
+
+    async def mget(self, keys: List[str], default: Any = None) -> List[Any]:
+        """Values of keys in one round trip"""
+        if not keys:
+            return []
+        started = time.perf_counter()
+        values = [self._decode(data) for data in await self.redis.mget([self._key(key) for key in keys])]
+        self._count(values, started)
+        return [default if value is MISSING else value for value in values]
+
+    async def mset(self, values: Dict[str, Any], ex: int):
+        """Sets all values with expiration in one round trip"""
+        pipe = self.redis.pipeline(transaction=False)
+        for key, value in values.items():
+            pipe.set(self._key(key), self._encode(value), ex=ex)
+        await pipe.execute()
+
+    async def delete(self, *keys: str):
+        await self.redis.delete(*[self._key(key) for key in keys])
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]], ex: int) -> Any:
+        """Cached value or result of compute. Concurrent misses of the same key wait for one computation"""
+        started = time.perf_counter()
+        value = self._decode(await self.redis.get(self._key(key)))
+        self._count([value], started)
+        if value is not MISSING:
+            return value
+
+        task = self._computing.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._compute_locked(key, compute, ex))
+            self._computing[key] = task
+            task.add_done_callback(lambda _: self._computing.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _compute_locked(self, key: str, compute: Callable[[], Awaitable[Any]], ex: int) -> Any:
+        lock_key = self._key(f"{key}:lock")
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+        delay = 0.01
+        while True:
+            if await self.redis.set(lock_key, token, nx=True, px=int(self.lock_timeout * 1000)):
+                try:
+                    return await self._compute(key, compute, ex)
+                finally:
+                    await self._release_lock(keys=[lock_key], args=[token])
+
+            # another process computes the value
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+            value = self._decode(await self.redis.get(self._key(key)))
+            if value is not MISSING:
+                return value
+            if time.monotonic() > deadline:
+                self.logger.warning(f"Cache lock of {key} is not released in {self.lock_timeout}s")
+                return await self._compute(key, compute, ex)
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Any]], ex: int) -> Any:
+        started = time.perf_counter()
+        value = await compute()
+        self.stats.computes += 1
+        self.stats.compute_seconds += time.perf_counter() - started
+        await self.set(key, value, ex)
+        return value
+
+    def cached(self, key: Callable[..., str], ex: int):
+        """Decorator for coroutine functions. key builds cache key from arguments of function"""
+
+        def decorator(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                return await self.get_or_compute(key(*args, **kwargs), lambda: func(*args, **kwargs), ex)
+            return wrapper
+        return decorator
+
+    async def run_stats_logging(self, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            self.logger.info(f"Cache stats: {self.stats.as_dict()}")
@@ -0,0 +1,91 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aioredis import Redis
+from aioredis.client import Pipeline
+
+# v2 totals are in minor units. Totals of old keys were floats in major units, INCRBY fails on them
+TOTAL_KEY = "budget:total:v2:{period}:{telegram_id}:{category_id}"
+LIMITS_KEY = "budget:limit:{telegram_id}"
+
+# KEYS - running totals. ARGV[1] - ttl, then expected total and total read before database for every key.
+# Missing part of expected total is added, so increments made since snapshot stay. Total is lowered only
+# if it has not changed since snapshot, otherwise it is left until next reconciliation
+RECONCILE_SCRIPT = """
+local ttl = tonumber(ARGV[1])
+for i, key in ipairs(KEYS) do
+    local expected = tonumber(ARGV[2 * i])
+    local snapshot = tonumber(ARGV[2 * i + 1])
+    local current = tonumber(redis.call('GET', key) or '0')
+    if expected > snapshot then
+        redis.call('INCRBY', key, expected - snapshot)
+        redis.call('EXPIRE', key, ttl)
+    elseif expected < snapshot and current == snapshot then
+        redis.call('SET', key, expected, 'EX', ttl)
+    end
+end
+return #KEYS
+"""
+RECONCILE_BATCH = 500
+
+
+class BudgetRepository:
+    """Running totals of expenses per user, category and period with budget limits. Sums are in minor units"""
+
+    def __init__(self, redis: Redis, totals_ttl: int):
+        self.redis = redis
+        self.totals_ttl = totals_ttl
+        self._reconcile = redis.register_script(RECONCILE_SCRIPT)
+
+    async def add_expense(self, telegram_id: int, category_id: int, period: str,
+                          spending_sum: int) -> Tuple[int, Optional[int]]:
+        """Increments running total and reads category limit in one round trip.
+        Returns new total and limit (None if there is no budget for category)"""
+        pipe = self.redis.pipeline(transaction=True)
+        self.add_expense_to_pipeline(pipe, telegram_id, category_id, period, spending_sum)
+        return self.parse_add_expense_result(await pipe.execute())
+
+    def add_expense_to_pipeline(self, pipe: Pipeline, telegram_id: int, category_id: int, period: str,
+                                spending_sum: int):
+        """Queues commands of add_expense, so they can be sent together with other commands"""
+        total_key = TOTAL_KEY.format(period=period, telegram_id=telegram_id, category_id=category_id)
+        pipe.incrby(total_key, spending_sum)
+        pipe.expire(total_key, self.totals_ttl)
+        pipe.hget(LIMITS_KEY.format(telegram_id=telegram_id), category_id)
+
+    @staticmethod
+    def parse_add_expense_result(results: List) -> Tuple[int, Optional[int]]:
+        """Total and limit from last results of pipeline with add_expense_to_pipeline commands"""
+        total, _, limit = results[-3:]
+        return int(total), int(limit) if limit is not None else None
+
+    async def set_limit(self, telegram_id: int, category_id: int, limit_sum: int):
+        await self.redis.hset(LIMITS_KEY.format(telegram_id=telegram_id), category_id, limit_sum)
+
+    async def get_totals(self, period: str) -> Dict[Tuple[int, int], int]:
+        """Running totals of period by (telegram_id, category_id)"""
+        keys = [key async for key in self.redis.scan_iter(
+            match=TOTAL_KEY.format(period=period, telegram_id="*", category_id="*"), count=1000)]
+        totals = {}
+        for i in range(0, len(keys), RECONCILE_BATCH):
+            batch = keys[i:i + RECONCILE_BATCH]
+            for key, total in zip(batch, await self.redis.mget(batch)):
+                if total is not None:
+                    _, telegram_id, category_id = key.rsplit(b":", 2)
+                    totals[(int(telegram_id), int(category_id))] = int(total)
+        return totals
+
+    async def reconcile_totals(self, period: str, rows: Iterable[Tuple[int, int, int, int]],
+                               snapshot: Dict[Tuple[int, int], int]):
+        """Overwrites limits and corrects totals by rows of (telegram_id, category_id, limit_sum, total).
+        snapshot is result of get_totals read before totals of rows, see RECONCILE_SCRIPT"""
+        rows = list(rows)
+        pipe = self.redis.pipeline(transaction=False)
+        for telegram_id, category_id, limit_sum, _ in rows:
+            pipe.hset(LIMITS_KEY.format(telegram_id=telegram_id), category_id, int(limit_sum))
+        await pipe.execute()
+        for i in range(0, len(rows), RECONCILE_BATCH):
+            keys, args = [], [self.totals_ttl]
+            for telegram_id, category_id, _, total in rows[i:i + RECONCILE_BATCH]:
+                keys.append(TOTAL_KEY.format(period=period, telegram_id=telegram_id, category_id=category_id))
+                args += [int(total), snapshot.get((telegram_id, category_id), 0)]
+            await self._reconcile(keys=keys, args=args)
@@ -0,0 +1,27 @@
+from typing import Optional
+
+from aioredis import Redis
+
+FILE_ID_KEY = "chart:file_id:{digest}"
+IMAGE_KEY = "chart:image:{digest}"
+
+
+class ChartRepository:
+    """Rendered charts and telegram file_id of uploaded charts by hash of chart data"""
+
+    def __init__(self, redis: Redis, ttl: int):
+        self.redis = redis
+        self.ttl = ttl
+
+    async def get_file_id(self, digest: str) -> Optional[str]:
+        file_id = await self.redis.get(FILE_ID_KEY.format(digest=digest))
+        return file_id.decode(encoding="utf-8") if file_id is not None else None
+
+    async def set_file_id(self, digest: str, file_id: str):
+        await self.redis.set(FILE_ID_KEY.format(digest=digest), file_id, ex=self.ttl)
+
+    async def get_image(self, digest: str) -> Optional[bytes]:
+        return await self.redis.get(IMAGE_KEY.format(digest=digest))
+
+    async def set_image(self, digest: str, image: bytes):
+        await self.redis.set(IMAGE_KEY.format(digest=digest), image, ex=self.ttl)
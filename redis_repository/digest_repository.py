@@ -0,0 +1,38 @@
+from typing import Iterable, Set
+
+from aioredis import Redis
+
+SENT_SLOT_KEY = "digest:{kind}:{date_from}:{slot}"
+SENT_USERS_KEY = "digest:{kind}:{date_from}:{slot}:users"
+
+
+class DigestRepository:
+    """Digest slots that are sent completely and users that already got digest of slot being sent"""
+
+    def __init__(self, redis: Redis, ttl: int):
+        self.redis = redis
+        self.ttl = ttl
+
+    async def is_slot_sent(self, kind: str, date_from: str, slot: int) -> bool:
+        return bool(await self.redis.exists(SENT_SLOT_KEY.format(kind=kind, date_from=date_from, slot=slot)))
+
+    async def set_slot_sent(self, kind: str, date_from: str, slot: int):
+        """Marks slot as sent, progress of users is not needed anymore"""
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.set(SENT_SLOT_KEY.format(kind=kind, date_from=date_from, slot=slot), 1, ex=self.ttl)
+        pipe.delete(SENT_USERS_KEY.format(kind=kind, date_from=date_from, slot=slot))
+        await pipe.execute()
+
+    async def get_sent_users(self, kind: str, date_from: str, slot: int) -> Set[int]:
+        members = await self.redis.smembers(SENT_USERS_KEY.format(kind=kind, date_from=date_from, slot=slot))
+        return {int(member) for member in members}
+
+    async def add_sent_users(self, kind: str, date_from: str, slot: int, telegram_ids: Iterable[int]):
+        telegram_ids = list(telegram_ids)
+        if not telegram_ids:
+            return
+        key = SENT_USERS_KEY.format(kind=kind, date_from=date_from, slot=slot)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.sadd(key, *telegram_ids)
+        pipe.expire(key, self.ttl)
+        await pipe.execute()
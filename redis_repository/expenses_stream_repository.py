@@ -0,0 +1,86 @@
+from typing import Dict, List, Tuple
+
+from aioredis import Redis
+from aioredis.client import Pipeline
+from aioredis.exceptions import ResponseError
+
+Entry = Tuple[bytes, Dict[bytes, bytes]]
+
+
+class ExpensesStreamRepository:
+    """Redis stream of expenses waiting for insert into database, read by consumer group.
+    Entries that can't be inserted are moved to dead letter stream"""
+
+    def __init__(self, redis: Redis, stream: str, group: str, dead_letter_stream: str):
+        self.redis = redis
+        self.stream = stream
+        self.group = group
+        self.dead_letter_stream = dead_letter_stream
+
+    def add_to_pipeline(self, pipe: Pipeline, fields: Dict[str, str]):
+        pipe.xadd(self.stream, fields)
+
+    async def create_group(self):
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as err:
+            if "BUSYGROUP" not in str(err):
+                raise
+
+    async def read(self, consumer: str, count: int, block_ms: int, pending: bool = False) -> List[Entry]:
+        """New entries for consumer. With pending=True entries delivered to consumer earlier and not acknowledged"""
+        response = await self.redis.xreadgroup(self.group, consumer, {self.stream: "0" if pending else ">"},
+                                               count=count, block=None if pending else block_ms)
+        if not response:
+            return []
+        return [entry for entry in response[0][1] if entry[1]]
+
+    async def claim_stale(self, consumer: str, min_idle_ms: int, count: int) -> List[Entry]:
+        """Takes entries of consumers that did not acknowledge them for min_idle_ms, for example stopped ones"""
+        response = await self.redis.xautoclaim(self.stream, self.group, consumer, min_idle_time=min_idle_ms,
+                                               start_id="0-0", count=count)
+        return [entry for entry in response[1] if entry[1]]
+
+    async def ack(self, entry_ids: List[bytes]):
+        """Acknowledges and deletes entries, so stream contains only not inserted expenses"""
+        if not entry_ids:
+            return
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xack(self.stream, self.group, *entry_ids)
+        pipe.xdel(self.stream, *entry_ids)
+        await pipe.execute()
+
+    async def delivery_counts(self, entry_ids: List[bytes]) -> Dict[bytes, int]:
+        """How many times not acknowledged entries were delivered to consumers. Every read of pending entry
+        and every claim counts as delivery"""
+        if not entry_ids:
+            return {}
+        pipe = self.redis.pipeline(transaction=False)
+        for entry_id in entry_ids:
+            pipe.xpending_range(self.stream, self.group, min=entry_id, max=entry_id, count=1)
+        return {pending["message_id"]: pending["times_delivered"]
+                for response in await pipe.execute() for pending in response}
+
+    async def dead_letter(self, entries: List[Entry], reason: str):
+        """Moves entries to dead letter stream with reason, so they are not read again"""
+        pipe = self.redis.pipeline(transaction=True)
+        for entry_id, fields in entries:
+            pipe.xadd(self.dead_letter_stream, {**fields, b"entry_id": entry_id, b"reason": reason})
+        entry_ids = [entry_id for entry_id, _ in entries]
+        pipe.xack(self.stream, self.group, *entry_ids)
+        pipe.xdel(self.stream, *entry_ids)
+        await pipe.execute()
+
+    async def entries(self, count: int = 1000) -> List[Entry]:
+        """All entries of stream, that is expenses not inserted into database yet. Read by count entries"""
+        entries, start = [], "-"
+        while True:
+            batch = await self.redis.xrange(self.stream, min=start, max="+", count=count)
+            entries += batch
+            if len(batch) < count:
+                return entries
+            # exclusive range, after the last entry read
+            start = b"(" + batch[-1][0]
+
+    async def length(self) -> int:
+        return await self.redis.xlen(self.stream)
@@ -0,0 +1,138 @@
+from typing import Dict, Optional
+
+from aioredis import Redis
+
+PRIORITIES = 10
+PRIORITY_STEP = 10 ** 13
+STATUSES = ("enqueued", "deduplicated", "done", "failed", "timeout", "requeued")
+
+# Job score is (PRIORITIES - 1 - priority) * PRIORITY_STEP + enqueue time in ms: higher priority first,
+# then first in first out. Scores stay below 10^14, so 14 digits of lua number to string are exact.
+# KEYS: queue, job hash, dedup flag, stats. ARGV: job_id, priority, dedup ttl ms, PRIORITIES, PRIORITY_STEP,
+# job fields. Returns 0 if the same job is already waiting or running
+ENQUEUE_SCRIPT = """
+if not redis.call('SET', KEYS[3], ARGV[1], 'NX', 'PX', ARGV[3]) then
+    redis.call('HINCRBY', KEYS[4], 'deduplicated', 1)
+    return 0
+end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local score = (tonumber(ARGV[4]) - 1 - tonumber(ARGV[2])) * tonumber(ARGV[5]) + now
+redis.call('HSET', KEYS[2], 'score', score, unpack(ARGV, 6))
+redis.call('ZADD', KEYS[1], score, ARGV[1])
+redis.call('HINCRBY', KEYS[4], 'enqueued', 1)
+return 1
+"""
+
+# Moves job with the lowest score from queue to running set with lease deadline as score.
+# KEYS: queue, running. ARGV: lease ms. Returns job_id or nil
+CLAIM_SCRIPT = """
+local popped = redis.call('ZPOPMIN', KEYS[1])
+if #popped == 0 then
+    return nil
+end
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[1]), popped[1])
+return popped[1]
+"""
+
+# Jobs with expired lease belong to stopped workers. They go back to queue until max attempts.
+# KEYS: queue, running, stats. ARGV: job key prefix, max attempts. Returns number of requeued jobs
+REQUEUE_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local requeued = 0
+for _, job_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', now, 'LIMIT', 0, 100)) do
+    redis.call('ZREM', KEYS[2], job_id)
+    local job_key = ARGV[1] .. job_id
+    if redis.call('EXISTS', job_key) == 1 then
+        if redis.call('HINCRBY', job_key, 'attempts', 1) < tonumber(ARGV[2]) then
+            redis.call('ZADD', KEYS[1], redis.call('HGET', job_key, 'score'), job_id)
+            redis.call('HINCRBY', KEYS[3], 'requeued', 1)
+            requeued = requeued + 1
+        else
+            redis.call('DEL', redis.call('HGET', job_key, 'dedup_key'), job_key)
+            redis.call('HINCRBY', KEYS[3], 'failed', 1)
+        end
+    end
+end
+return requeued
+"""
+
+
+class JobsRepository:
+    """Priority queue of jobs in redis. Waiting jobs are in sorted set, jobs taken by workers are in running
+    sorted set with lease deadline, job fields are in hash"""
+
+    def __init__(self, redis: Redis, prefix: str = "jobs"):
+        self.redis = redis
+        self.prefix = prefix
+        self.queue_key = f"{prefix}:queue"
+        self.running_key = f"{prefix}:running"
+        self.stats_key = f"{prefix}:stats"
+        self._enqueue = redis.register_script(ENQUEUE_SCRIPT)
+        self._claim = redis.register_script(CLAIM_SCRIPT)
+        self._requeue = redis.register_script(REQUEUE_SCRIPT)
+
+    def job_key(self, job_id: str) -> str:
+        return f"{self.prefix}:job:{job_id}"
+
+    def dedup_key(self, dedup_key: str) -> str:
+        return f"{self.prefix}:dedup:{dedup_key}"
+
+    async def enqueue(self, job_id: str, priority: int, dedup_key: str, dedup_ttl_ms: int,
+                      fields: Dict[str, str]) -> bool:
+        """Adds job to queue. Returns False if job with the same dedup_key is waiting or running"""
+        if not 0 <= priority < PRIORITIES:
+            raise ValueError(f"Priority must be from 0 to {PRIORITIES - 1}")
+        fields = {**fields, "dedup_key": self.dedup_key(dedup_key), "attempts": 0}
+        args = [job_id, priority, dedup_ttl_ms, PRIORITIES, PRIORITY_STEP]
+        for name, value in fields.items():
+            args += [name, value]
+        return bool(await self._enqueue(
+            keys=[self.queue_key, self.job_key(job_id), self.dedup_key(dedup_key), self.stats_key], args=args))
+
+    async def claim(self, lease_ms: int) -> Optional[Dict[bytes, bytes]]:
+        """Takes job with the highest priority for lease_ms. Returns job fields with job_id or None"""
+        job_id = await self._claim(keys=[self.queue_key, self.running_key], args=[lease_ms])
+        if job_id is None:
+            return None
+        fields = await self.redis.hgetall(self.job_key(job_id.decode()))
+        if not fields:
+            await self.redis.zrem(self.running_key, job_id)
+            return None
+        return {**fields, b"job_id": job_id}
+
+    async def finish(self, job_id: str, dedup_key: str, status: str):
+        """Removes job and its dedup flag, so the same job can be enqueued again"""
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.zrem(self.running_key, job_id)
+        pipe.delete(self.job_key(job_id), dedup_key)
+        pipe.hincrby(self.stats_key, status, 1)
+        await pipe.execute()
+
+    async def requeue_expired(self, max_attempts: int) -> int:
+        return await self._requeue(keys=[self.queue_key, self.running_key, self.stats_key],
+                                   args=[self.job_key(""), max_attempts])
+
+    async def metrics(self) -> Dict[str, int]:
+        """Queue depth by priority, running jobs, wait time of the oldest waiting job in ms and status counters"""
+        pipe = self.redis.pipeline(transaction=False)
+        for priority in range(PRIORITIES):
+            step = PRIORITIES - 1 - priority
+            pipe.zcount(self.queue_key, step * PRIORITY_STEP, f"({(step + 1) * PRIORITY_STEP}")
+            pipe.zrangebyscore(self.queue_key, step * PRIORITY_STEP, f"({(step + 1) * PRIORITY_STEP}",
+                               start=0, num=1, withscores=True)
+        pipe.zcard(self.running_key)
+        pipe.hgetall(self.stats_key)
+        pipe.time()
+        *by_priority, running, stats, (seconds, microseconds) = await pipe.execute()
+
+        depths, oldest = by_priority[::2], [int(score) for first in by_priority[1::2] for _, score in first]
+        now = seconds * 1000 + microseconds // 1000
+        metrics = {"depth": sum(depths), "running": running,
+                   "oldest_wait_ms": max((now - score % PRIORITY_STEP for score in oldest), default=0)}
+        metrics.update({f"depth_priority_{priority}": depth for priority, depth in enumerate(depths) if depth})
+        metrics.update({status: int(stats.get(status.encode(), 0)) for status in STATUSES})
+        return metrics
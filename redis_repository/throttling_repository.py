@@ -0,0 +1,46 @@
+from typing import Tuple
+
+from aioredis import Redis
+
+THROTTLING_KEY = "throttling:{telegram_id}"
+NOTIFIED_KEY = "throttling:notified:{telegram_id}"
+
+# GCRA. KEYS[1] - theoretical arrival time of user, KEYS[2] - flag that user was told about throttling.
+# ARGV: emission interval in ms, burst, cost. Returns {allowed, retry_after_ms, notify}
+GCRA_SCRIPT = """
+local emission = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local tat = tonumber(redis.call('GET', KEYS[1]))
+if not tat or tat < now then
+    tat = now
+end
+local new_tat = tat + emission * cost
+local allow_at = new_tat - emission * burst
+if allow_at > now then
+    local retry_after = math.ceil(allow_at - now)
+    local notify = redis.call('SET', KEYS[2], 1, 'NX', 'PX', retry_after)
+    return {0, retry_after, notify and 1 or 0}
+end
+redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil(new_tat - now))
+return {1, 0, 0}
+"""
+
+
+class ThrottlingRepository:
+    """Per user rate limit. Every check is one call of lua script"""
+
+    def __init__(self, redis: Redis, rate: float, burst: int):
+        self.redis = redis
+        self.emission_interval = 1000 / rate
+        self.burst = burst
+        self._script = redis.register_script(GCRA_SCRIPT)
+
+    async def acquire(self, telegram_id: int, cost: int = 1) -> Tuple[bool, int, bool]:
+        """Returns if update is allowed, retry after in ms and if user should be told about throttling"""
+        allowed, retry_after, notify = await self._script(
+            keys=[THROTTLING_KEY.format(telegram_id=telegram_id), NOTIFIED_KEY.format(telegram_id=telegram_id)],
+            args=[self.emission_interval, self.burst, cost])
+        return bool(allowed), int(retry_after), bool(notify)